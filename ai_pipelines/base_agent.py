@@ -6,19 +6,102 @@ Provides common functionality for all MediSense agents
 import os
 import json
 import logging
+import random
+import threading
+import time
+from functools import lru_cache, wraps
 from typing import Dict, Any, Optional, List
 from datetime import datetime
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 
+from .config import AgentConfig
+
 logger = logging.getLogger(__name__)
 
 
+def _is_rate_limit_error(error: Exception) -> bool:
+    """Check if an exception looks like a transient 429/quota error"""
+    message = str(error).lower()
+    return any(
+        marker in message
+        for marker in ('429', 'quota', 'rate limit', 'resource exhausted', 'resource_exhausted')
+    )
+
+
+@lru_cache(maxsize=16)
+def _get_model(model_name: str, temperature: float, max_output_tokens: int) -> "genai.GenerativeModel":
+    """
+    Build (or reuse) a configured Gemini model handle
+
+    Agents sharing a (model, temperature, max_tokens) configuration get
+    the same handle, so per-request agent construction skips the model
+    setup cost.
+    """
+    return genai.GenerativeModel(
+        model_name=model_name,
+        generation_config={
+            "temperature": temperature,
+            "max_output_tokens": max_output_tokens,
+            "response_mime_type": "application/json"
+        },
+        safety_settings={
+            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+        }
+    )
+
+
+def retry_with_backoff(
+    max_retries: int = AgentConfig.LLM_MAX_RETRIES,
+    base_delay: float = AgentConfig.LLM_RETRY_BASE_DELAY,
+    max_delay: float = 30.0
+):
+    """
+    Decorator that retries rate-limited calls with exponential backoff
+
+    Only transient 429/quota errors are retried; anything else propagates
+    immediately so real failures still surface to the caller.
+
+    Args:
+        max_retries: Maximum number of retries after the first attempt
+        base_delay: Initial delay in seconds (doubles each retry)
+        max_delay: Upper bound on the delay between retries
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            delay = base_delay
+            for attempt in range(max_retries + 1):
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    if attempt == max_retries or not _is_rate_limit_error(e):
+                        raise
+                    # Full jitter to spread out concurrent retries
+                    sleep_for = min(delay, max_delay) * (0.5 + random.random() / 2)
+                    logger.warning(
+                        f"Rate limited in {func.__name__} "
+                        f"(attempt {attempt + 1}/{max_retries + 1}), "
+                        f"retrying in {sleep_for:.1f}s: {e}"
+                    )
+                    time.sleep(sleep_for)
+                    delay *= 2
+        return wrapper
+    return decorator
+
+
 class BaseAgent:
     """
     Base class for all MediSense agents using Google Gemini
     """
 
+    # Shared across all agents so concurrent requests cannot thunder the
+    # Gemini quota - caps in-flight calls process-wide
+    _llm_semaphore = threading.BoundedSemaphore(AgentConfig.MAX_CONCURRENT_LLM)
+
     def __init__(
         self,
         name: str,
@@ -49,21 +132,11 @@ class BaseAgent:
 
         genai.configure(api_key=api_key)
 
-        # Initialize model with safety settings
-        self.model = genai.GenerativeModel(
-            model_name=self.model_name,
-            generation_config={
-                "temperature": self.temperature,
-                "max_output_tokens": self.max_output_tokens,
-                "response_mime_type": "application/json"
-            },
-            safety_settings={
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-            }
-        )
+        # Get cached model handle (shared across agents with same config)
+        self.model = _get_model(self.model_name, self.temperature, self.max_output_tokens)
+
+        # System prompt is constant per agent - cache on first use
+        self._system_prompt = None
 
         logger.info(f"Initialized {self.name} with model {self.model_name}")
 
@@ -87,6 +160,24 @@ class BaseAgent:
         """
         raise NotImplementedError("Subclasses must implement process()")
 
+    @retry_with_backoff()
+    def _call_model(self, full_prompt: str) -> str:
+        """
+        Call Gemini with concurrency capping and rate-limit retries
+
+        Streams the response so text chunks are consumed as they are
+        generated instead of waiting for the full completion buffer.
+
+        Args:
+            full_prompt: Complete prompt including system instructions
+
+        Returns:
+            Complete response text
+        """
+        with BaseAgent._llm_semaphore:
+            response = self.model.generate_content(full_prompt, stream=True)
+            return ''.join(chunk.text for chunk in response)
+
     def generate_response(
         self,
         prompt: str,
@@ -103,8 +194,10 @@ class BaseAgent:
             Parsed JSON response
         """
         try:
-            # Build full prompt with system instructions
-            system_prompt = self.get_system_prompt()
+            # Build full prompt with system instructions (cached per agent)
+            if self._system_prompt is None:
+                self._system_prompt = self.get_system_prompt()
+            system_prompt = self._system_prompt
 
             # Add context if provided
             if context:
@@ -113,12 +206,12 @@ class BaseAgent:
             else:
                 full_prompt = f"{system_prompt}\n\n### Task:\n{prompt}"
 
-            # Generate response
-            response = self.model.generate_content(full_prompt)
+            # Generate response (bounded by shared semaphore, retried on 429)
+            response_text = self._call_model(full_prompt)
 
             # Parse JSON response
             try:
-                result = json.loads(response.text)
+                result = json.loads(response_text)
                 result['_metadata'] = {
                     'agent': self.name,
                     'model': self.model_name,
@@ -131,7 +224,7 @@ class BaseAgent:
                 return {
                     'success': False,
                     'error': 'Invalid JSON response from model',
-                    'raw_response': response.text
+                    'raw_response': response_text
                 }
 
         except Exception as e:
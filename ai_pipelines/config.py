@@ -37,6 +37,8 @@ class AgentConfig:
 
     # Search Configuration
     DEFAULT_TOP_K = 5
+    QUERY_EMBED_BATCH_SIZE = int(os.getenv('QUERY_EMBED_BATCH_SIZE', '32'))
+    QUERY_EMBED_BATCH_WINDOW = float(os.getenv('QUERY_EMBED_BATCH_WINDOW', '0.05'))  # seconds
     HYBRID_SEARCH_WEIGHTS = {
         'semantic': 0.6,
         'keyword': 0.3,
@@ -47,16 +49,31 @@ class AgentConfig:
     ENABLE_BATCH_PROCESSING = True
     BATCH_SIZE = 10
 
+    # Concurrency Configuration
+    MAX_CONCURRENT_LLM = int(os.getenv('MAX_CONCURRENT_LLM', '4'))
+
+    # Retry Configuration (for transient 429/quota errors)
+    LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+    LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', '1.0'))
+
     # Logging Configuration
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FILE = os.getenv('LOG_FILE', 'logs/agents.log')
 
+    # Cached so the app and each agent can call validate() freely
+    # without re-running the checks
+    _validated = False
+
     @classmethod
     def validate(cls):
-        """Validate configuration"""
+        """Validate configuration (result cached after first success)"""
+        if cls._validated:
+            return True
+
         if not cls.GOOGLE_API_KEY:
             raise ValueError("GOOGLE_API_KEY is required. Please set it in .env file")
 
+        cls._validated = True
         return True
 
     @classmethod
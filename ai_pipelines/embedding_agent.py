@@ -133,6 +133,31 @@ class EmbeddingAgent(BaseAgent):
             logger.error(f"Error creating query embedding: {e}")
             raise
 
+    def create_query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        """
+        Create embeddings for multiple search queries in a single API call
+
+        Args:
+            queries: List of search query texts
+
+        Returns:
+            List of query embedding vectors (same order as queries)
+        """
+        try:
+            import google.generativeai as genai
+
+            result = genai.embed_content(
+                model=self.embedding_model,
+                content=queries,
+                task_type="retrieval_query"
+            )
+
+            return result['embedding']
+
+        except Exception as e:
+            logger.error(f"Error creating batch query embeddings: {e}")
+            raise
+
     def batch_process(self, texts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
         Create embeddings for multiple texts
@@ -4,12 +4,15 @@ Coordinates the multi-agent workflow according to the architecture diagram
 """
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List, Optional
 import json
 from datetime import datetime
 import chromadb
 from chromadb.config import Settings
+from chromadb.utils import embedding_functions
 
+from .config import AgentConfig
 from .ocr_agent import OCRAgent
 from .medical_ner_agent import MedicalNERAgent
 from .prescription_parser_agent import PrescriptionParserAgent
@@ -62,19 +65,34 @@ class AgentOrchestrator:
             settings=Settings(anonymized_telemetry=False)
         )
 
+        # Register Google embedding function on the collection so query()
+        # can embed search text itself - one call instead of two
+        query_embedding_function = embedding_functions.GoogleGenerativeAiEmbeddingFunction(
+            api_key=agent_kwargs.get('api_key') or AgentConfig.GOOGLE_API_KEY,
+            model_name="models/text-embedding-004"
+        )
+
         # Get or create collection
         try:
-            self.collection = self.vector_db_client.get_collection(collection_name)
+            self.collection = self.vector_db_client.get_collection(
+                collection_name,
+                embedding_function=query_embedding_function
+            )
             logger.info(f"Loaded existing collection: {collection_name}")
         except:
             self.collection = self.vector_db_client.create_collection(
                 name=collection_name,
-                metadata={"description": "MediSense medical records embeddings"}
+                metadata={"description": "MediSense medical records embeddings"},
+                embedding_function=query_embedding_function
             )
             logger.info(f"Created new collection: {collection_name}")
 
         # Initialize search and analyser agents with vector DB
-        self.search_agent = SearchAgent(vector_db=self.collection, **agent_kwargs)
+        self.search_agent = SearchAgent(
+            vector_db=self.collection,
+            vector_db_embeds_queries=True,
+            **agent_kwargs
+        )
         self.analyser_agent = AIAnalyserAgent(**agent_kwargs)
 
         logger.info("Agent Orchestrator initialized successfully")
@@ -130,26 +148,34 @@ class AgentOrchestrator:
             extracted_text = ocr_result.get('extracted_text', '')
             detected_document_type = ocr_result.get('document_type', document_type or 'unknown')
 
-            # ===== STAGE 2: Medical NER - Entity Extraction =====
-            logger.info("Stage 2: Medical NER Entity Extraction")
-            ner_result = self.ner_agent.process({
+            # ===== STAGES 2+3: Medical NER and Prescription Parser =====
+            # Both stages only need the OCR text, so for prescriptions
+            # they run concurrently - each one is dominated by model API
+            # latency, not CPU
+            ner_input = {
                 'text': extracted_text,
                 'patient_id': patient_id,
                 'document_type': detected_document_type
-            })
-
-            processing_result['pipeline_stages']['ner'] = ner_result
+            }
 
-            # ===== STAGE 3: Prescription Parser (if applicable) =====
             prescription_result = None
             if detected_document_type in ['prescription', 'rx']:
-                logger.info("Stage 3: Prescription Parsing")
-                prescription_result = self.prescription_agent.process({
-                    'text': extracted_text,
-                    'patient_id': patient_id,
-                    'ocr_metadata': ocr_result.get('metadata', {})
-                })
+                logger.info("Stages 2+3: Medical NER + Prescription Parsing (concurrent)")
+                with ThreadPoolExecutor(max_workers=2) as stage_pool:
+                    ner_future = stage_pool.submit(self.ner_agent.process, ner_input)
+                    prescription_future = stage_pool.submit(self.prescription_agent.process, {
+                        'text': extracted_text,
+                        'patient_id': patient_id,
+                        'ocr_metadata': ocr_result.get('metadata', {})
+                    })
+                    ner_result = ner_future.result()
+                    prescription_result = prescription_future.result()
                 processing_result['pipeline_stages']['prescription'] = prescription_result
+            else:
+                logger.info("Stage 2: Medical NER Entity Extraction")
+                ner_result = self.ner_agent.process(ner_input)
+
+            processing_result['pipeline_stages']['ner'] = ner_result
 
             # ===== STAGE 4: 7-Layer Anomaly Detection =====
             logger.info("Stage 4: 7-Layer Anomaly Detection")
@@ -463,18 +489,22 @@ class AgentOrchestrator:
             documents: List of dicts with file_path, patient_id, etc.
 
         Returns:
-            List of processing results
+            List of processing results (same order as documents)
         """
-        results = []
+        if not documents:
+            return []
 
-        for doc in documents:
-            result = self.process_patient_document(
+        def _process(doc):
+            return self.process_patient_document(
                 file_path=doc['file_path'],
                 patient_id=doc['patient_id'],
                 document_type=doc.get('document_type'),
                 patient_metadata=doc.get('patient_metadata'),
                 historical_records=doc.get('historical_records')
             )
-            results.append(result)
 
-        return results
+        # Bounded fan-out: each document spends its time waiting on
+        # model APIs, so a small pool saturates the external services
+        # without flooding them
+        with ThreadPoolExecutor(max_workers=min(8, len(documents))) as pool:
+            return list(pool.map(_process, documents))
@@ -4,12 +4,125 @@ Specialized in parsing Indian prescription formats and dosage instructions
 """
 
 import logging
+import re
+from datetime import datetime, timedelta
 from typing import Dict, Any, List
 
 from .base_agent import BaseAgent
 
 logger = logging.getLogger(__name__)
 
+# Dose-pattern dispatch table covering the canonical Indian prescription
+# shorthands (numeric morning-afternoon-night patterns and frequency
+# codes) - maps a normalized pattern straight to its schedule slots
+_PATTERN_SLOTS = {
+    '1-0-0': ('morning',),
+    '0-1-0': ('afternoon',),
+    '0-0-1': ('bedtime',),
+    '1-0-1': ('morning', 'bedtime'),
+    '1-1-0': ('morning', 'afternoon'),
+    '0-1-1': ('afternoon', 'bedtime'),
+    '1-1-1': ('morning', 'afternoon', 'evening'),
+    '1-1-1-1': ('morning', 'afternoon', 'evening', 'bedtime'),
+    'OD': ('morning',),
+    'QD': ('morning',),
+    'BD': ('morning', 'bedtime'),
+    'BID': ('morning', 'bedtime'),
+    'TDS': ('morning', 'afternoon', 'evening'),
+    'TID': ('morning', 'afternoon', 'evening'),
+    'QID': ('morning', 'afternoon', 'evening', 'bedtime'),
+    'HS': ('bedtime',),
+    'PRN': ('as_needed',),
+    'SOS': ('as_needed',),
+}
+
+# Precompiled timing keyword matcher for the fallback path
+_TIMING_RE = re.compile(r'(morning|afternoon|evening|night|bedtime|prn|sos)', re.IGNORECASE)
+
+_TIMING_SLOTS = {
+    'morning': 'morning',
+    'afternoon': 'afternoon',
+    'evening': 'evening',
+    'night': 'bedtime',
+    'bedtime': 'bedtime',
+    'prn': 'as_needed',
+    'sos': 'as_needed',
+}
+
+# Canonical expansions for the prescription abbreviations documented in
+# the system prompt (multi-character forms only - single letters are too
+# ambiguous to rewrite)
+ABBREVIATION_TABLE = {
+    'OD': 'once daily',
+    'QD': 'once daily',
+    'BD': 'twice daily',
+    'BID': 'twice daily',
+    'TDS': 'three times daily',
+    'TID': 'three times daily',
+    'QID': 'four times daily',
+    'HS': 'at bedtime',
+    'PRN': 'as needed',
+    'SOS': 'as needed',
+    'STAT': 'immediately',
+    'AC': 'before meals',
+    'PC': 'after meals',
+    'BF': 'before food',
+    'AF': 'after food',
+    'PO': 'by mouth',
+    'SL': 'sublingual',
+    'TOP': 'topical',
+    'IV': 'intravenous',
+    'IM': 'intramuscular',
+    'SC': 'subcutaneous',
+    'SQ': 'subcutaneous',
+    'PR': 'per rectum',
+    'PV': 'per vaginum',
+    'INH': 'inhalation',
+    'TAB': 'tablet',
+    'CAP': 'capsule',
+    'SYR': 'syrup',
+    'INJ': 'injection',
+    'OINT': 'ointment',
+    'SUSP': 'suspension',
+    'SOL': 'solution',
+    'GTT': 'drops',
+}
+
+# One alternation matching every abbreviation at word boundaries -
+# canonicalization is a single scan of the text regardless of table size
+_ABBREV_RE = re.compile(
+    r'\b(' + '|'.join(sorted(ABBREVIATION_TABLE, key=len, reverse=True)) + r')\b',
+    re.IGNORECASE
+)
+
+
+def canonicalize_abbreviations(text: str) -> str:
+    """
+    Expand prescription abbreviations to their canonical descriptions
+
+    Single-pass replacement over the whole text - every abbreviation in
+    ABBREVIATION_TABLE is handled in one scan instead of one str.replace
+    pass per abbreviation.
+
+    Args:
+        text: Text possibly containing prescription abbreviations
+
+    Returns:
+        Text with abbreviations expanded
+    """
+    if not text:
+        return text
+    return _ABBREV_RE.sub(
+        lambda match: ABBREVIATION_TABLE[match.group(1).upper()], text
+    )
+
+# Duration unit -> days multiplier
+_DURATION_DAYS = {
+    'days': 1,
+    'weeks': 7,
+    'months': 30,
+}
+
 
 class PrescriptionParserAgent(BaseAgent):
     """
@@ -302,35 +415,29 @@ Patient ID (from system): {patient_id or 'Not provided'}
         try:
             medications = parsed_data.get('medications', [])
 
+            # Single base timestamp - all refill dates in one prescription
+            # are relative to the same moment
+            now = datetime.now()
+
             for med in medications:
-                # Calculate total tablets/doses
-                if 'frequency' in med and 'duration' in med:
-                    times_per_day = med['frequency'].get('times_per_day', 0)
-                    duration_days = med['duration'].get('value', 0)
-                    duration_unit = med['duration'].get('unit', 'days')
+                if 'duration' not in med:
+                    continue
 
-                    # Convert duration to days
-                    if duration_unit == 'weeks':
-                        duration_days *= 7
-                    elif duration_unit == 'months':
-                        duration_days *= 30
+                # Convert duration to days once per medication
+                duration = med['duration']
+                duration_days = (
+                    duration.get('value', 0) *
+                    _DURATION_DAYS.get(duration.get('unit', 'days'), 1)
+                )
 
-                    total_doses = times_per_day * duration_days
-                    med['calculated_total_doses'] = total_doses
+                # Calculate total tablets/doses
+                if 'frequency' in med:
+                    times_per_day = med['frequency'].get('times_per_day', 0)
+                    med['calculated_total_doses'] = times_per_day * duration_days
 
                 # Add refill date
-                if 'duration' in med:
-                    from datetime import datetime, timedelta
-                    duration_days = med['duration'].get('value', 0)
-                    duration_unit = med['duration'].get('unit', 'days')
-
-                    if duration_unit == 'weeks':
-                        duration_days *= 7
-                    elif duration_unit == 'months':
-                        duration_days *= 30
-
-                    refill_date = datetime.now() + timedelta(days=duration_days)
-                    med['refill_date'] = refill_date.strftime('%Y-%m-%d')
+                refill_date = now + timedelta(days=duration_days)
+                med['refill_date'] = refill_date.strftime('%Y-%m-%d')
 
             return parsed_data
 
@@ -395,23 +502,24 @@ Return validation results in JSON format with:
         }
 
         for med in medications:
-            pattern = med.get('frequency', {}).get('pattern', '')
-            timing = med.get('timing', '').lower()
-
-            med_summary = f"{med.get('drug_name')} {med.get('strength')}{med.get('unit')} {timing}"
-
-            if pattern == '1-0-0' or 'morning' in timing:
-                schedule['morning'].append(med_summary)
-            elif pattern == '0-0-1' or 'night' in timing or 'bedtime' in timing:
-                schedule['bedtime'].append(med_summary)
-            elif pattern == '1-0-1':
-                schedule['morning'].append(med_summary)
-                schedule['bedtime'].append(med_summary)
-            elif pattern == '1-1-1':
-                schedule['morning'].append(med_summary)
-                schedule['afternoon'].append(med_summary)
-                schedule['evening'].append(med_summary)
-            elif 'prn' in pattern.lower() or 'sos' in pattern.lower():
-                schedule['as_needed'].append(med_summary)
+            frequency = med.get('frequency', {})
+            pattern = (frequency.get('pattern') or '').strip().upper()
+            code = (frequency.get('code') or '').strip().upper()
+            timing = (med.get('timing') or '').lower()
+
+            med_summary = (
+                f"{med.get('drug_name')} {med.get('strength')}{med.get('unit')} "
+                f"{canonicalize_abbreviations(timing)}"
+            )
+
+            # Dispatch on the dose pattern or frequency code, falling back
+            # to a single precompiled scan of the timing text
+            slots = _PATTERN_SLOTS.get(pattern) or _PATTERN_SLOTS.get(code)
+            if slots is None:
+                match = _TIMING_RE.search(timing)
+                slots = (_TIMING_SLOTS[match.group(1).lower()],) if match else ()
+
+            for slot in slots:
+                schedule[slot].append(med_summary)
 
         return schedule
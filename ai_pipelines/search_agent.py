@@ -3,15 +3,112 @@ Search Agent using Google Gemini
 Implements hybrid semantic + keyword search for medical records
 """
 
+import asyncio
+import heapq
 import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from operator import itemgetter
 from typing import Dict, Any, List, Optional
 import json
 
+import numpy as np
+
 from .base_agent import BaseAgent
+from .config import AgentConfig
 from .embedding_agent import EmbeddingAgent
 
 logger = logging.getLogger(__name__)
 
+# Fast-path lexicons: short queries made up entirely of these terms have
+# obvious intent, so the LLM query-analysis round-trip can be skipped
+_BIOMARKER_TERMS = frozenset({
+    'hba1c', 'glucose', 'ldl', 'hdl', 'cholesterol', 'triglycerides',
+    'tsh', 't3', 't4', 'hemoglobin', 'creatinine', 'urea', 'sodium',
+    'potassium', 'vitamin', 'b12', 'd3', 'esr', 'crp', 'platelets',
+    'wbc', 'rbc', 'bilirubin', 'sgpt', 'sgot', 'albumin', 'uric'
+})
+
+_MEDICATION_TERMS = frozenset({
+    'metformin', 'insulin', 'atorvastatin', 'amlodipine', 'telmisartan',
+    'aspirin', 'paracetamol', 'ibuprofen', 'omeprazole', 'pantoprazole',
+    'levothyroxine', 'losartan', 'metoprolol', 'clopidogrel',
+    'azithromycin', 'amoxicillin', 'cetirizine', 'montelukast'
+})
+
+_DISEASE_TERMS = frozenset({
+    'diabetes', 'hypertension', 'asthma', 'anemia', 'thyroid',
+    'hypothyroidism', 'hyperthyroidism', 'dyslipidemia', 'obesity',
+    'arthritis', 'migraine', 'gastritis', 'dengue', 'malaria',
+    'typhoid', 'covid', 'tuberculosis'
+})
+
+_QUERY_STOPWORDS = frozenset({
+    'my', 'me', 'the', 'a', 'an', 'of', 'for', 'show', 'find', 'what',
+    'is', 'are', 'latest', 'recent', 'all', 'level', 'levels', 'value',
+    'values', 'report', 'reports', 'test', 'tests', 'mg', 'ml', 'and'
+})
+
+_FAST_QUERY_RE = re.compile(r'^[\w\s,.\-/%]{1,80}$')
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Standard reciprocal-rank-fusion constant
+_RRF_K = 60
+
+
+class _QueryEmbeddingBatcher:
+    """
+    Coalesces concurrent query embeddings into batched API calls
+
+    Queries arriving within a short window are embedded with a single
+    embed_content call, amortizing the per-call overhead under load.
+    """
+
+    def __init__(
+        self,
+        embed_batch_fn,
+        max_batch_size: int = AgentConfig.QUERY_EMBED_BATCH_SIZE,
+        max_wait_seconds: float = AgentConfig.QUERY_EMBED_BATCH_WINDOW
+    ):
+        self._embed_batch_fn = embed_batch_fn
+        self._max_batch_size = max_batch_size
+        self._max_wait_seconds = max_wait_seconds
+        self._lock = threading.Lock()
+        self._pending = []  # list of (query, Future)
+        self._worker = None
+
+    def embed(self, query: str) -> List[float]:
+        """Queue a query and block until its embedding is available"""
+        future = Future()
+        with self._lock:
+            self._pending.append((query, future))
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._drain, daemon=True)
+                self._worker.start()
+        return future.result()
+
+    def _drain(self):
+        """Worker loop: wait out the batching window, then flush batches"""
+        while True:
+            time.sleep(self._max_wait_seconds)
+            with self._lock:
+                batch = self._pending[:self._max_batch_size]
+                self._pending = self._pending[self._max_batch_size:]
+                if not batch:
+                    self._worker = None
+                    return
+
+            try:
+                embeddings = self._embed_batch_fn([query for query, _ in batch])
+                for (_, future), embedding in zip(batch, embeddings):
+                    future.set_result(embedding)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
 
 class SearchAgent(BaseAgent):
     """
@@ -19,7 +116,7 @@ class SearchAgent(BaseAgent):
     Combines semantic search, keyword search, and ranking
     """
 
-    def __init__(self, vector_db=None, **kwargs):
+    def __init__(self, vector_db=None, vector_db_embeds_queries=False, **kwargs):
         super().__init__(
             name="Search Agent",
             model="gemini-2.0-flash-exp",
@@ -31,8 +128,19 @@ class SearchAgent(BaseAgent):
         # Initialize embedding agent for semantic search
         self.embedding_agent = EmbeddingAgent(**kwargs)
 
-        # Store reference to vector database
+        # Microbatch concurrent query embeddings into single API calls
+        self._embedding_batcher = _QueryEmbeddingBatcher(
+            self.embedding_agent.create_query_embeddings
+        )
+
+        # Store reference to vector database; when the collection has an
+        # embedding function registered, query() embeds search text itself
         self.vector_db = vector_db
+        self.vector_db_embeds_queries = vector_db_embeds_queries
+
+        # Keyword search is a stub until SQL integration lands - don't
+        # over-fetch from the vector DB on its behalf
+        self._keyword_enabled = False
 
     def get_system_prompt(self) -> str:
         return """
@@ -177,6 +285,9 @@ Default weights: w1=0.4, w2=0.3, w3=0.1, w4=0.15, w5=0.05
         """
         Process search query and return ranked results
 
+        Synchronous entry point for Flask routes and the orchestrator -
+        runs the async pipeline on a fresh event loop.
+
         Args:
             input_data: Dictionary containing:
                 - query: Search query string (required)
@@ -186,6 +297,18 @@ Default weights: w1=0.4, w2=0.3, w3=0.1, w4=0.15, w5=0.05
                 - date_range: Optional date range filter
                 - document_types: Optional list of document types to filter
 
+        Returns:
+            Dictionary with search results
+        """
+        return asyncio.run(self.process_async(input_data))
+
+    async def process_async(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Async search pipeline - runs query analysis and retrieval concurrently
+
+        Args:
+            input_data: Same as process()
+
         Returns:
             Dictionary with search results
         """
@@ -199,16 +322,26 @@ Default weights: w1=0.4, w2=0.3, w3=0.1, w4=0.15, w5=0.05
             date_range = input_data.get('date_range')
             document_types = input_data.get('document_types')
 
-            # Step 1: Analyze query
-            query_analysis = self._analyze_query(query)
-
-            # Step 2: Perform search based on mode
+            # Steps 1 & 2: Analyze query and search concurrently - neither
+            # depends on the other, so latency is max(analyze, search)
             if search_mode == 'semantic':
-                results = self._semantic_search(query, patient_id, top_k)
+                search_coro = self._semantic_search(query, patient_id, top_k)
             elif search_mode == 'keyword':
-                results = self._keyword_search(query, patient_id, top_k)
+                search_coro = self._keyword_search(query, patient_id, top_k)
             else:  # hybrid
-                results = self._hybrid_search(query, patient_id, top_k)
+                search_coro = self._hybrid_search(query, patient_id, top_k)
+
+            # Skip the LLM analysis round-trip for short, entity-clean
+            # queries where the intent is obvious from the lexicon
+            fast_analysis = self._fast_classify(query)
+            if fast_analysis is not None:
+                query_analysis = fast_analysis
+                results = await search_coro
+            else:
+                query_analysis, results = await asyncio.gather(
+                    self._analyze_query(query),
+                    search_coro
+                )
 
             # Step 3: Apply filters if provided
             if date_range:
@@ -217,7 +350,20 @@ Default weights: w1=0.4, w2=0.3, w3=0.1, w4=0.15, w5=0.05
             if document_types:
                 results = self._filter_by_type(results, document_types)
 
-            # Step 4: Generate response with ranking
+            # Step 4: Generate response with ranking - send a slim,
+            # compact view of the results (full documents trimmed to
+            # snippets, no pretty-printing) to keep input tokens down
+            slim_results = [
+                {
+                    'record_id': r.get('record_id'),
+                    'semantic_similarity': round(r.get('semantic_similarity', 0.0), 3),
+                    'keyword_score': round(r.get('keyword_score', 0.0), 3),
+                    'metadata': r.get('metadata', {}),
+                    'snippet': (r.get('document') or '')[:400]
+                }
+                for r in results[:top_k]
+            ]
+
             prompt = f"""
 Analyze the search query and rank the results appropriately.
 
@@ -226,10 +372,10 @@ Analyze the search query and rank the results appropriately.
 **Search Mode:** {search_mode}
 
 **Query Analysis:**
-{json.dumps(query_analysis, indent=2)}
+{json.dumps(query_analysis, separators=(',', ':'))}
 
 **Search Results:**
-{json.dumps(results[:top_k], indent=2)}
+{json.dumps(slim_results, separators=(',', ':'))}
 
 **Task:**
 1. Rank results by clinical relevance and similarity
@@ -241,7 +387,7 @@ Analyze the search query and rank the results appropriately.
 **Important:** Prioritize clinically significant findings.
 """
 
-            response = self.generate_response(prompt)
+            response = await asyncio.to_thread(self.generate_response, prompt)
 
             # Log execution
             output_data = {
@@ -262,7 +408,61 @@ Analyze the search query and rank the results appropriately.
                 'query': input_data.get('query')
             }
 
-    def _analyze_query(self, query: str) -> Dict[str, Any]:
+    def _fast_classify(self, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Classify trivial queries without the LLM round-trip
+
+        Args:
+            query: Search query string
+
+        Returns:
+            Query analysis dict if every token is a known medical term,
+            number or stopword; None if the query needs LLM analysis
+        """
+        if not _FAST_QUERY_RE.match(query):
+            return None
+
+        tokens = _TOKEN_RE.findall(query.lower())
+        if not tokens:
+            return None
+
+        biomarkers, medications, diseases = [], [], []
+        for token in tokens:
+            if token in _BIOMARKER_TERMS:
+                biomarkers.append(token)
+            elif token in _MEDICATION_TERMS:
+                medications.append(token)
+            elif token in _DISEASE_TERMS:
+                diseases.append(token)
+            elif token not in _QUERY_STOPWORDS and not token.isdigit():
+                # Unknown word - fall through to LLM analysis
+                return None
+
+        if not (biomarkers or medications or diseases):
+            return None
+
+        if medications:
+            search_intent = 'find_medication'
+        elif biomarkers:
+            search_intent = 'find_lab_results'
+        else:
+            search_intent = 'find_diagnosis'
+
+        return {
+            'original_query': query,
+            'processed_query': query,
+            'search_intent': search_intent,
+            'key_concepts': biomarkers + medications + diseases,
+            'medical_entities': {
+                'diseases': diseases,
+                'medications': medications,
+                'biomarkers': biomarkers
+            },
+            'temporal_context': {'has_date_constraint': False},
+            'fast_path': True
+        }
+
+    async def _analyze_query(self, query: str) -> Dict[str, Any]:
         """
         Analyze search query to understand intent
 
@@ -287,10 +487,10 @@ Analyze this medical search query:
 Return analysis in JSON format.
 """
 
-        result = self.generate_response(prompt)
+        result = await asyncio.to_thread(self.generate_response, prompt)
         return result.get('query_analysis', {}) if result.get('success') else {}
 
-    def _semantic_search(
+    async def _semantic_search(
         self,
         query: str,
         patient_id: Optional[str],
@@ -307,41 +507,103 @@ Return analysis in JSON format.
         Returns:
             List of search results
         """
+        ids, similarities, metadatas, documents = await self._semantic_search_soa(
+            query, patient_id, top_k
+        )
+
+        # Materialize result dicts only at the boundary; tolist() converts
+        # the whole similarity array in one C pass
+        return [
+            {
+                'record_id': record_id,
+                'semantic_similarity': similarity,
+                'metadata': metadata,
+                'document': document
+            }
+            for record_id, similarity, metadata, document
+            in zip(ids, similarities.tolist(), metadatas, documents)
+        ]
+
+    async def _semantic_search_soa(
+        self,
+        query: str,
+        patient_id: Optional[str],
+        top_k: int
+    ):
+        """
+        Semantic search keeping Chroma's struct-of-arrays layout
+
+        Avoids building per-record dicts for results that fusion will
+        discard; similarities come back as a NumPy array.
+
+        Args:
+            query: Search query
+            patient_id: Optional patient filter
+            top_k: Number of results
+
+        Returns:
+            Tuple of (ids, similarities array, metadatas, documents)
+        """
+        empty = [], np.empty(0, dtype=np.float32), [], []
+
         try:
             if not self.vector_db:
                 logger.warning("Vector DB not available, returning empty results")
-                return []
+                return empty
 
-            # Create query embedding
-            query_embedding = self.embedding_agent.create_query_embedding(query)
-
-            # Search in vector DB
             where_filter = {"patient_id": patient_id} if patient_id else None
 
-            results = self.vector_db.query(
-                query_embeddings=[query_embedding],
-                n_results=top_k,
-                where=where_filter
-            )
-
-            # Format results
-            formatted_results = []
-            if results and 'ids' in results and len(results['ids']) > 0:
-                for i, record_id in enumerate(results['ids'][0]):
-                    formatted_results.append({
-                        'record_id': record_id,
-                        'semantic_similarity': float(1 - results['distances'][0][i]) if 'distances' in results else 0.0,
-                        'metadata': results['metadatas'][0][i] if 'metadatas' in results else {},
-                        'document': results['documents'][0][i] if 'documents' in results else ''
-                    })
+            if self.vector_db_embeds_queries:
+                # Fused path: collection embeds the query text itself -
+                # one call covers embedding plus search
+                results = await asyncio.to_thread(
+                    self.vector_db.query,
+                    query_texts=[query],
+                    n_results=top_k,
+                    where=where_filter
+                )
+            else:
+                # Create query embedding (coalesced with concurrent queries)
+                query_embedding = await asyncio.to_thread(
+                    self._embedding_batcher.embed, query
+                )
+
+                results = await asyncio.to_thread(
+                    self.vector_db.query,
+                    query_embeddings=[query_embedding],
+                    n_results=top_k,
+                    where=where_filter
+                )
+
+            if not results or not results.get('ids') or not results['ids']:
+                return empty
+
+            ids = results['ids'][0]
+            count = len(ids)
+
+            # Single probe per optional column, hoisted out of any loop
+            distances = results.get('distances')
+            metadatas = results.get('metadatas')
+            documents = results.get('documents')
+
+            # Vectorized 1 - distance instead of per-element float math
+            if distances:
+                similarities = 1.0 - np.asarray(distances[0], dtype=np.float32)
+            else:
+                similarities = np.zeros(count, dtype=np.float32)
 
-            return formatted_results
+            return (
+                ids,
+                similarities,
+                metadatas[0] if metadatas else [{}] * count,
+                documents[0] if documents else [''] * count
+            )
 
         except Exception as e:
             logger.error(f"Error in semantic search: {e}")
-            return []
+            return empty
 
-    def _keyword_search(
+    async def _keyword_search(
         self,
         query: str,
         patient_id: Optional[str],
@@ -363,7 +625,7 @@ Return analysis in JSON format.
         logger.info(f"Keyword search for: {query}")
         return []
 
-    def _hybrid_search(
+    async def _hybrid_search(
         self,
         query: str,
         patient_id: Optional[str],
@@ -380,47 +642,75 @@ Return analysis in JSON format.
         Returns:
             Combined and ranked results
         """
-        # Get results from both methods
-        semantic_results = self._semantic_search(query, patient_id, top_k * 2)
-        keyword_results = self._keyword_search(query, patient_id, top_k * 2)
-
-        # Combine and deduplicate
-        combined = {}
-
-        # Add semantic results
-        for result in semantic_results:
-            record_id = result['record_id']
-            combined[record_id] = {
-                **result,
-                'keyword_score': 0.0
-            }
-
-        # Add keyword results
-        for result in keyword_results:
+        # Only over-fetch when there is a second leg to fuse against
+        if self._keyword_enabled:
+            # Get results from both methods concurrently; semantic side
+            # stays in struct-of-arrays form until after fusion
+            (ids, similarities, metadatas, documents), keyword_results = await asyncio.gather(
+                self._semantic_search_soa(query, patient_id, top_k * 2),
+                self._keyword_search(query, patient_id, top_k * 2)
+            )
+        else:
+            ids, similarities, metadatas, documents = await self._semantic_search_soa(
+                query, patient_id, top_k
+            )
+            keyword_results = []
+
+        # Pure-semantic short-circuit: Chroma order is already the ranking
+        if not keyword_results:
+            return [
+                {
+                    'record_id': record_id,
+                    'semantic_similarity': similarity,
+                    'keyword_score': 0.0,
+                    'metadata': metadata,
+                    'document': document,
+                    'combined_score': similarity
+                }
+                for record_id, similarity, metadata, document
+                in zip(ids[:top_k], similarities[:top_k].tolist(), metadatas, documents)
+            ]
+
+        # Reciprocal-rank fusion: both sides are already ranked, so fuse
+        # on rank positions instead of rebuilding every result into a
+        # dedup dict - robust to score-scale mismatch between the legs
+        scores = defaultdict(float)
+        for rank, record_id in enumerate(ids):
+            scores[record_id] += 0.6 / (_RRF_K + rank)
+
+        keyword_by_id = {}
+        for rank, result in enumerate(keyword_results):
             record_id = result['record_id']
-            if record_id in combined:
-                combined[record_id]['keyword_score'] = result.get('keyword_score', 0.0)
+            scores[record_id] += 0.4 / (_RRF_K + rank)
+            keyword_by_id[record_id] = result
+
+        # O(N log k) top-k selection; materialize dicts only for winners
+        top = heapq.nlargest(top_k, scores.items(), key=itemgetter(1))
+
+        index_by_id = {record_id: i for i, record_id in enumerate(ids)}
+        similarity_list = similarities.tolist()
+
+        fused = []
+        for record_id, score in top:
+            i = index_by_id.get(record_id)
+            if i is not None:
+                keyword_hit = keyword_by_id.get(record_id)
+                fused.append({
+                    'record_id': record_id,
+                    'semantic_similarity': similarity_list[i],
+                    'keyword_score': keyword_hit.get('keyword_score', 0.0) if keyword_hit else 0.0,
+                    'metadata': metadatas[i],
+                    'document': documents[i],
+                    'combined_score': score
+                })
             else:
-                combined[record_id] = {
-                    **result,
-                    'semantic_similarity': 0.0
-                }
-
-        # Calculate combined scores
-        for record_id, data in combined.items():
-            data['combined_score'] = (
-                0.6 * data.get('semantic_similarity', 0.0) +
-                0.4 * data.get('keyword_score', 0.0)
-            )
-
-        # Sort by combined score
-        sorted_results = sorted(
-            combined.values(),
-            key=lambda x: x['combined_score'],
-            reverse=True
-        )
+                fused.append({
+                    **keyword_by_id[record_id],
+                    'semantic_similarity': 0.0,
+                    'combined_score': score
+                })
 
-        return sorted_results[:top_k]
+        return fused
 
     def _filter_by_date(
         self,
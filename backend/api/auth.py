@@ -3,82 +3,130 @@ Authentication API Endpoints for MediVault
 Handles signup, login, and OAuth
 """
 
-from flask import Blueprint, request, jsonify
+import logging
+
+import orjson
+from flask import Blueprint, request, jsonify, Response
+from database import get_database
 from services.auth_service import get_auth_service
 from functools import wraps
 
+logger = logging.getLogger(__name__)
+
 # Create blueprint
 auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
 
-# Get auth service
+# Get services
+db = get_database()
 auth_service = get_auth_service()
 
+# Required request-body fields per endpoint (module-level so the hot
+# handlers don't rebuild the lists on every call)
+_PATIENT_REQUIRED = ('email', 'password', 'full_name')
+_DOCTOR_REQUIRED = ('email', 'password', 'full_name', 'license_number', 'specialization')
+_OAUTH_REQUIRED = ('google_id', 'email', 'full_name')
+
+
+def _missing_field(data, required):
+    """Return the first required field that is absent or falsy, else None"""
+    return next((field for field in required if not data.get(field)), None)
+
+
+def _conditional_user_response(payload):
+    """
+    Serve a user-specific payload with a weak ETag
+
+    The tag derives from the per-user version counter bumped on profile
+    and password changes, so SPA polling collapses to 304s until the
+    user actually changes. Skipped entirely when Redis is disabled -
+    without the counter a stale tag could mask real updates.
+    """
+    if not auth_service.cache.enabled:
+        return jsonify(payload), 200
+
+    tag = f"{request.user['id']}:{auth_service.user_version(request.user['id'])}"
+    if request.if_none_match.contains_weak(tag):
+        response = Response(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(tag, weak=True)
+    response.headers['Cache-Control'] = 'private, must-revalidate'
+    return response
+
 
 # ============================================================================
-# MIDDLEWARE/DECORATORS
+# ERROR HANDLING
 # ============================================================================
 
-def require_auth(f):
-    """Decorator to require authentication"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        # Get token from header
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Missing or invalid authorization header'}), 401
+@auth_bp.errorhandler(ValueError)
+def _handle_value_error(e):
+    """Validation and credential failures raised by auth_service"""
+    return jsonify({'error': str(e)}), 400
 
-        token = auth_header.split(' ')[1]
 
-        # Verify token
-        user = auth_service.get_current_user(token)
-        if not user:
-            return jsonify({'error': 'Invalid or expired token'}), 401
+@auth_bp.errorhandler(Exception)
+def _handle_unexpected_error(e):
+    """Last-resort handler: log the traceback, never echo internals"""
+    logger.exception(f"Unhandled error in {request.path}")
+    return jsonify({'error': 'Internal server error'}), 500
 
-        # Add user to request context
-        request.user = user
-        return f(*args, **kwargs)
 
-    return decorated_function
+# ============================================================================
+# MIDDLEWARE/DECORATORS
+# ============================================================================
 
+def _json():
+    """Parse the request body with orjson (2-3x faster than get_json)"""
+    return orjson.loads(request.get_data(cache=False) or b'{}')
 
-def require_patient(f):
-    """Decorator to require patient access"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Missing or invalid authorization header'}), 401
 
-        token = auth_header.split(' ')[1]
+def _extract_bearer():
+    """Get the bearer token from the Authorization header (None if absent)"""
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        return auth_header[7:]  # len('Bearer ') - slice, no split allocation
+    return None
 
-        try:
-            user = auth_service.require_patient(token)
-            request.user = user
-            return f(*args, **kwargs)
-        except ValueError as e:
-            return jsonify({'error': str(e)}), 403
 
-    return decorated_function
+def _make_auth_decorator(checker):
+    """
+    Build an auth decorator around a token -> user checker
 
+    The three decorators below shared the same header parsing and
+    request.user wiring; they differ only in which auth_service call
+    validates the token. Role checkers signal failure with ValueError
+    (403), a missing user means an invalid token (401).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            token = _extract_bearer()
+            if not token:
+                return jsonify({'error': 'Missing or invalid authorization header'}), 401
 
-def require_doctor(f):
-    """Decorator to require doctor access"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Missing or invalid authorization header'}), 401
+            try:
+                user = checker(token)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 403
 
-        token = auth_header.split(' ')[1]
+            if not user:
+                return jsonify({'error': 'Invalid or expired token'}), 401
 
-        try:
-            user = auth_service.require_doctor(token)
             request.user = user
             return f(*args, **kwargs)
-        except ValueError as e:
-            return jsonify({'error': str(e)}), 403
 
-    return decorated_function
+        return decorated_function
+    return decorator
+
+
+# Decorator to require authentication
+require_auth = _make_auth_decorator(auth_service.get_current_user)
+
+# Decorator to require patient access
+require_patient = _make_auth_decorator(auth_service.require_patient)
+
+# Decorator to require doctor access
+require_doctor = _make_auth_decorator(auth_service.require_doctor)
 
 
 # ============================================================================
@@ -108,13 +156,12 @@ def signup_patient():
         }
     """
     try:
-        data = request.get_json()
+        data = _json()
 
         # Validate required fields
-        required_fields = ['email', 'password', 'full_name']
-        for field in required_fields:
-            if not data.get(field):
-                return jsonify({'error': f'Missing required field: {field}'}), 400
+        missing = _missing_field(data, _PATIENT_REQUIRED)
+        if missing:
+            return jsonify({'error': f'Missing required field: {missing}'}), 400
 
         # Register patient
         result = auth_service.register_patient(
@@ -134,8 +181,6 @@ def signup_patient():
 
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
-    except Exception as e:
-        return jsonify({'error': f'Registration failed: {str(e)}'}), 500
 
 
 @auth_bp.route('/signup/doctor', methods=['POST'])
@@ -162,13 +207,12 @@ def signup_doctor():
         }
     """
     try:
-        data = request.get_json()
+        data = _json()
 
         # Validate required fields
-        required_fields = ['email', 'password', 'full_name', 'license_number', 'specialization']
-        for field in required_fields:
-            if not data.get(field):
-                return jsonify({'error': f'Missing required field: {field}'}), 400
+        missing = _missing_field(data, _DOCTOR_REQUIRED)
+        if missing:
+            return jsonify({'error': f'Missing required field: {missing}'}), 400
 
         # Register doctor
         result = auth_service.register_doctor(
@@ -189,8 +233,6 @@ def signup_doctor():
 
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
-    except Exception as e:
-        return jsonify({'error': f'Registration failed: {str(e)}'}), 500
 
 
 @auth_bp.route('/login', methods=['POST'])
@@ -212,7 +254,7 @@ def login():
         }
     """
     try:
-        data = request.get_json()
+        data = _json()
 
         # Validate required fields
         if not data.get('email') or not data.get('password'):
@@ -232,8 +274,6 @@ def login():
 
     except ValueError as e:
         return jsonify({'error': str(e)}), 401
-    except Exception as e:
-        return jsonify({'error': f'Login failed: {str(e)}'}), 500
 
 
 # ============================================================================
@@ -261,32 +301,27 @@ def google_oauth():
             "token": "jwt-token-here"
         }
     """
-    try:
-        data = request.get_json()
-
-        # Validate required fields
-        required_fields = ['google_id', 'email', 'full_name']
-        for field in required_fields:
-            if not data.get(field):
-                return jsonify({'error': f'Missing required field: {field}'}), 400
-
-        # Login with Google
-        result = auth_service.login_with_google(
-            google_id=data['google_id'],
-            email=data['email'],
-            full_name=data['full_name'],
-            profile_picture_url=data.get('profile_picture_url'),
-            user_type=data.get('user_type', 'patient')
-        )
+    data = _json()
+
+    # Validate required fields
+    missing = _missing_field(data, _OAUTH_REQUIRED)
+    if missing:
+        return jsonify({'error': f'Missing required field: {missing}'}), 400
+
+    # Login with Google
+    result = auth_service.login_with_google(
+        google_id=data['google_id'],
+        email=data['email'],
+        full_name=data['full_name'],
+        profile_picture_url=data.get('profile_picture_url'),
+        user_type=data.get('user_type', 'patient')
+    )
 
-        return jsonify({
-            'success': True,
-            'user': result['user'],
-            'token': result['token']
-        }), 200
-
-    except Exception as e:
-        return jsonify({'error': f'OAuth login failed: {str(e)}'}), 500
+    return jsonify({
+        'success': True,
+        'user': result['user'],
+        'token': result['token']
+    }), 200
 
 
 # ============================================================================
@@ -308,32 +343,14 @@ def get_session():
             "user": {...}
         }
     """
-    user_data = {
-        'id': request.user['id'],
-        'email': request.user['email'],
-        'full_name': request.user['full_name'],
-        'user_type': request.user['user_type'],
-        'profile_picture_url': request.user.get('profile_picture_url')
-    }
-
-    # Add type-specific fields
-    if request.user['user_type'] == 'patient':
-        user_data.update({
-            'age': request.user.get('age'),
-            'gender': request.user.get('gender'),
-            'date_of_birth': request.user.get('date_of_birth')
-        })
-    elif request.user['user_type'] == 'doctor':
-        user_data.update({
-            'license_number': request.user.get('license_number'),
-            'specialization': request.user.get('specialization'),
-            'hospital_affiliation': request.user.get('hospital_affiliation')
-        })
+    # The session view is pre-shaped (and cached) by auth_service when
+    # the user is resolved - no per-request dict assembly here
+    user_data = request.user.get('_session_view') or auth_service.build_session_view(request.user)
 
-    return jsonify({
+    return _conditional_user_response({
         'success': True,
         'user': user_data
-    }), 200
+    })
 
 
 @auth_bp.route('/refresh', methods=['POST'])
@@ -350,26 +367,20 @@ def refresh_token():
             "token": "new-jwt-token-here"
         }
     """
-    try:
-        # Get token from header
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Missing or invalid authorization header'}), 401
+    # Get token from header
+    token = _extract_bearer()
+    if not token:
+        return jsonify({'error': 'Missing or invalid authorization header'}), 401
 
-        token = auth_header.split(' ')[1]
-
-        # Refresh token
-        new_token = auth_service.refresh_token(token)
-        if not new_token:
-            return jsonify({'error': 'Invalid or expired token'}), 401
-
-        return jsonify({
-            'success': True,
-            'token': new_token
-        }), 200
+    # Refresh token
+    new_token = auth_service.refresh_token(token)
+    if not new_token:
+        return jsonify({'error': 'Invalid or expired token'}), 401
 
-    except Exception as e:
-        return jsonify({'error': f'Token refresh failed: {str(e)}'}), 500
+    return jsonify({
+        'success': True,
+        'token': new_token
+    }), 200
 
 
 @auth_bp.route('/logout', methods=['POST'])
@@ -389,6 +400,8 @@ def logout():
     """
     # Note: With JWT, logout is mainly client-side (delete token)
     # Server could maintain blacklist of tokens if needed
+    auth_service.invalidate_token_cache(_extract_bearer())
+
     return jsonify({
         'success': True,
         'message': 'Logged out successfully'
@@ -420,35 +433,33 @@ def change_password():
             "message": "Password changed successfully"
         }
     """
-    try:
-        data = request.get_json()
+    data = _json()
 
-        if not data.get('current_password') or not data.get('new_password'):
-            return jsonify({'error': 'Current and new passwords are required'}), 400
+    if not data.get('current_password') or not data.get('new_password'):
+        return jsonify({'error': 'Current and new passwords are required'}), 400
 
-        # Verify current password
-        user = request.user
-        if not user.get('password_hash'):
-            return jsonify({'error': 'Cannot change password for OAuth accounts'}), 400
+    # Verify current password
+    user = request.user
+    if not user.get('password_hash'):
+        return jsonify({'error': 'Cannot change password for OAuth accounts'}), 400
 
-        if not auth_service.verify_password(data['current_password'], user['password_hash']):
-            return jsonify({'error': 'Current password is incorrect'}), 401
+    if not auth_service.verify_password(data['current_password'], user['password_hash']):
+        return jsonify({'error': 'Current password is incorrect'}), 401
 
-        # Hash new password
-        new_password_hash = auth_service.hash_password(data['new_password'])
+    # Hash new password
+    new_password_hash = auth_service.hash_password(data['new_password'])
 
-        # Update password
-        from database import get_database
-        db = get_database()
-        db.update_user(user['id'], {'password_hash': new_password_hash})
+    # Update password
+    db.update_user(user['id'], {'password_hash': new_password_hash})
 
-        return jsonify({
-            'success': True,
-            'message': 'Password changed successfully'
-        }), 200
+    # Drop the cached user so the new hash is seen immediately
+    auth_service.invalidate_token_cache(_extract_bearer())
+    auth_service.bump_user_version(user['id'])
 
-    except Exception as e:
-        return jsonify({'error': f'Password change failed: {str(e)}'}), 500
+    return jsonify({
+        'success': True,
+        'message': 'Password changed successfully'
+    }), 200
 
 
 # ============================================================================
@@ -470,10 +481,10 @@ def get_profile():
             "user": {...}
         }
     """
-    return jsonify({
+    return _conditional_user_response({
         'success': True,
         'user': request.user
-    }), 200
+    })
 
 
 @auth_bp.route('/profile', methods=['PUT'])
@@ -499,39 +510,46 @@ def update_profile():
             "user": {...}
         }
     """
-    try:
-        data = request.get_json()
-        user = request.user
-
-        # Fields that can be updated
-        allowed_fields = ['full_name', 'phone', 'profile_picture_url']
-
-        if user['user_type'] == 'patient':
-            allowed_fields.extend(['gender', 'date_of_birth', 'address'])
-        elif user['user_type'] == 'doctor':
-            allowed_fields.extend(['specialization', 'hospital_affiliation'])
-
-        # Build update dict
-        updates = {}
-        for field in allowed_fields:
-            if field in data:
-                updates[field] = data[field]
-
-        if not updates:
-            return jsonify({'error': 'No valid fields to update'}), 400
-
-        # Update user
-        from database import get_database
-        db = get_database()
-        updated_user = db.update_user(user['id'], updates)
-
+    data = _json()
+    user = request.user
+
+    # Fields that can be updated
+    allowed_fields = ['full_name', 'phone', 'profile_picture_url']
+
+    if user['user_type'] == 'patient':
+        allowed_fields.extend(['gender', 'date_of_birth', 'address'])
+    elif user['user_type'] == 'doctor':
+        allowed_fields.extend(['specialization', 'hospital_affiliation'])
+
+    # Build update dict
+    updates = {}
+    for field in allowed_fields:
+        if field in data:
+            updates[field] = data[field]
+
+    if not updates:
+        return jsonify({'error': 'No valid fields to update'}), 400
+
+    # Skip the write (and the cache invalidation below) when every
+    # submitted value already matches - SPAs re-submit unchanged forms
+    changed = {k: v for k, v in updates.items() if user.get(k) != v}
+    if not changed:
         return jsonify({
             'success': True,
-            'user': updated_user
+            'user': {k: v for k, v in user.items() if k != '_session_view'}
         }), 200
 
-    except Exception as e:
-        return jsonify({'error': f'Profile update failed: {str(e)}'}), 500
+    # Update user
+    updated_user = db.update_user(user['id'], changed)
+
+    # Drop the cached user so the updated profile is seen immediately
+    auth_service.invalidate_token_cache(_extract_bearer())
+    auth_service.bump_user_version(user['id'])
+
+    return jsonify({
+        'success': True,
+        'user': updated_user
+    }), 200
 
 
 # ============================================================================
@@ -3,27 +3,107 @@ Doctor API Endpoints for MediVault
 Handles doctor-specific operations: patient access, notes, etc.
 """
 
-from flask import Blueprint, request, jsonify
+import base64
+import logging
+
+from flask import Blueprint, g, request, jsonify, Response, make_response
 from datetime import datetime, timedelta
+from functools import wraps
 
 from api.auth import require_doctor, require_auth
 from database import get_database
 from services.auth_service import get_auth_service
+from services.cache import get_cache_service
 
 # Create blueprint
 doctor_bp = Blueprint('doctor', __name__, url_prefix='/api/doctor')
 
+logger = logging.getLogger(__name__)
+
 # Get services
 db = get_database()
 auth_service = get_auth_service()
 
 
+@doctor_bp.errorhandler(Exception)
+def _handle_unexpected_error(e):
+    """Last-resort handler: log the traceback, never echo internals"""
+    logger.exception(f"Unhandled error in {request.path}")
+    return jsonify({'error': 'Internal server error'}), 500
+
+
+def _has_patient_access(doctor_id, patient_id):
+    """
+    Check doctor access with a Redis fast path
+
+    Every doctor endpoint runs this check before its real query. A
+    positive result is remembered in a per-doctor Redis set, so repeat
+    checks are an O(1) SISMEMBER instead of a database query. Only
+    positive membership is trusted - a miss always falls back to SQL,
+    so a patient never gets falsely denied - and the 5 minute TTL
+    bounds how long a revocation can lag.
+    """
+    # Request-scoped memo: endpoints that check the same pair more than
+    # once within one request never leave the process
+    memo = getattr(g, '_access_memo', None)
+    if memo is None:
+        memo = g._access_memo = {}
+    pair = (doctor_id, patient_id)
+    if pair in memo:
+        return memo[pair]
+
+    cache = get_cache_service()
+    key = f"doc_access:{doctor_id}"
+
+    if cache.set_is_member(key, patient_id):
+        memo[pair] = True
+        return True
+
+    allowed = db.check_doctor_access(doctor_id, patient_id)
+    if allowed:
+        cache.set_add(key, patient_id, expire_seconds=300)
+    memo[pair] = allowed
+    return allowed
+
+
+def cached_response(ttl=30):
+    """
+    Short-TTL Redis cache for dashboard read endpoints
+
+    Keys on (user, path, query string) so each doctor sees their own
+    data. Only 200 responses are stored; polling clients are served the
+    cached body instead of re-running the database queries. Staleness
+    is bounded by the TTL.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            cache = get_cache_service()
+            key = f"resp:{request.user['id']}:{request.path}:{request.query_string.decode()}"
+
+            cached = cache.get(key)
+            if cached is not None:
+                return Response(cached['body'], status=cached['status'], mimetype='application/json')
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                cache.set(
+                    key,
+                    {'body': response.get_data(as_text=True), 'status': 200},
+                    expire_seconds=ttl
+                )
+            return response
+        return wrapper
+    return decorator
+
+
 # ============================================================================
 # PATIENT ACCESS MANAGEMENT
 # ============================================================================
 
 @doctor_bp.route('/patients', methods=['GET'])
 @require_doctor
+@cached_response(ttl=30)
 def get_doctor_patients():
     """
     Get all patients the doctor has access to
@@ -31,25 +111,32 @@ def get_doctor_patients():
     Headers:
         Authorization: Bearer <token>
 
+    Query params:
+        limit: int (default: 50, max: 200)
+        offset: int (default: 0)
+
     Returns:
         {
             "success": true,
             "patients": [...]
         }
     """
-    try:
-        doctor = request.user
+    doctor = request.user
 
-        # Get all accessible patients
-        patients = db.get_doctor_patients(doctor['id'])
+    # Always bounded - an unpaginated list grows without limit as
+    # patients grant access (the 30s response cache covers polling)
+    limit = min(int(request.args.get('limit', 50)), 200)
+    offset = int(request.args.get('offset', 0))
 
-        return jsonify({
-            'success': True,
-            'patients': patients
-        }), 200
+    patients = db.get_doctor_patients(doctor['id'], limit=limit, offset=offset)
 
-    except Exception as e:
-        return jsonify({'error': f'Failed to retrieve patients: {str(e)}'}), 500
+    return jsonify({
+        'success': True,
+        'patients': patients,
+        'count': len(patients),
+        'limit': limit,
+        'offset': offset
+    }), 200
 
 
 @doctor_bp.route('/patient/<patient_id>', methods=['GET'])
@@ -70,56 +157,38 @@ def get_patient_details(patient_id):
             "summary": {...}
         }
     """
-    try:
-        doctor = request.user
-
-        # Check access
-        if not db.check_doctor_access(doctor['id'], patient_id):
-            return jsonify({'error': 'Access denied to this patient'}), 403
-
-        # Get patient info
-        patient = db.get_user_by_id(patient_id)
-        if not patient:
-            return jsonify({'error': 'Patient not found'}), 404
-
-        # Get recent records
-        recent_records = db.get_patient_records(
-            patient_id=patient_id,
-            limit=10,
-            order_by='created_at'
-        )
-
-        # Get critical anomalies
-        critical_anomalies = db.get_patient_anomalies(
-            patient_id=patient_id,
-            critical_only=True,
-            unacknowledged_only=True
-        )
-
-        # Get summary
-        summary = db.get_patient_summary(patient_id)
-
-        return jsonify({
-            'success': True,
-            'patient': {
-                'id': patient['id'],
-                'full_name': patient['full_name'],
-                'email': patient['email'],
-                'age': patient.get('age'),
-                'gender': patient.get('gender'),
-                'phone': patient.get('phone')
-            },
-            'recent_records': recent_records,
-            'critical_anomalies': critical_anomalies,
-            'summary': summary
-        }), 200
-
-    except Exception as e:
-        return jsonify({'error': f'Failed to retrieve patient details: {str(e)}'}), 500
+    doctor = request.user
+
+    # Check access
+    if not _has_patient_access(doctor['id'], patient_id):
+        return jsonify({'error': 'Access denied to this patient'}), 403
+
+    # Get patient, recent records, anomalies, and summary in one call
+    overview = db.get_patient_overview(patient_id, recent_limit=10)
+
+    patient = overview['patient']
+    if not patient:
+        return jsonify({'error': 'Patient not found'}), 404
+
+    return jsonify({
+        'success': True,
+        'patient': {
+            'id': patient['id'],
+            'full_name': patient['full_name'],
+            'email': patient['email'],
+            'age': patient.get('age'),
+            'gender': patient.get('gender'),
+            'phone': patient.get('phone')
+        },
+        'recent_records': overview['recent_records'],
+        'critical_anomalies': overview['critical_anomalies'],
+        'summary': overview['summary']
+    }), 200
 
 
 @doctor_bp.route('/patient/<patient_id>/records', methods=['GET'])
 @require_doctor
+@cached_response(ttl=30)
 def get_patient_records(patient_id):
     """
     Get all medical records for a specific patient
@@ -129,45 +198,61 @@ def get_patient_records(patient_id):
 
     Query params:
         limit: int (default: 20)
-        offset: int (default: 0)
+        cursor: opaque cursor from the previous page's next_cursor
 
     Returns:
         {
             "success": true,
-            "records": [...]
+            "records": [...],
+            "next_cursor": "..."  # null on the last page
         }
     """
-    try:
-        doctor = request.user
-
-        # Check access
-        if not db.check_doctor_access(doctor['id'], patient_id):
-            return jsonify({'error': 'Access denied to this patient'}), 403
-
-        limit = min(int(request.args.get('limit', 20)), 100)
-        offset = int(request.args.get('offset', 0))
-
-        records = db.get_patient_records(
-            patient_id=patient_id,
-            limit=limit,
-            offset=offset,
-            order_by='created_at'
-        )
-
-        return jsonify({
-            'success': True,
-            'records': records,
-            'total': len(records),
-            'limit': limit,
-            'offset': offset
-        }), 200
-
-    except Exception as e:
-        return jsonify({'error': f'Failed to retrieve records: {str(e)}'}), 500
+    doctor = request.user
+
+    # Check access
+    if not _has_patient_access(doctor['id'], patient_id):
+        return jsonify({'error': 'Access denied to this patient'}), 403
+
+    limit = min(int(request.args.get('limit', 20)), 100)
+
+    # Keyset pagination: the cursor encodes (created_at, id) of the
+    # last row seen, so deep pages cost the same as the first one
+    after = None
+    cursor_param = request.args.get('cursor')
+    if cursor_param:
+        try:
+            created_at, _, record_id = base64.urlsafe_b64decode(
+                cursor_param.encode()
+            ).decode().partition('|')
+            after = (created_at, record_id)
+        except Exception:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+    records = db.get_patient_records_page(
+        patient_id=patient_id,
+        limit=limit,
+        after=after
+    )
+
+    next_cursor = None
+    if len(records) == limit:
+        last = records[-1]
+        next_cursor = base64.urlsafe_b64encode(
+            f"{last['created_at']}|{last['id']}".encode()
+        ).decode()
+
+    return jsonify({
+        'success': True,
+        'records': records,
+        'count': len(records),
+        'limit': limit,
+        'next_cursor': next_cursor
+    }), 200
 
 
 @doctor_bp.route('/patient/<patient_id>/biomarkers/<biomarker_type>', methods=['GET'])
 @require_doctor
+@cached_response(ttl=30)
 def get_patient_biomarker_trend(patient_id, biomarker_type):
     """
     Get biomarker trend for a patient
@@ -185,29 +270,25 @@ def get_patient_biomarker_trend(patient_id, biomarker_type):
             "data": [...]
         }
     """
-    try:
-        doctor = request.user
-
-        # Check access
-        if not db.check_doctor_access(doctor['id'], patient_id):
-            return jsonify({'error': 'Access denied to this patient'}), 403
+    doctor = request.user
 
-        days = int(request.args.get('days', 90))
+    # Check access
+    if not _has_patient_access(doctor['id'], patient_id):
+        return jsonify({'error': 'Access denied to this patient'}), 403
 
-        trend_data = db.get_biomarker_trend(
-            patient_id=patient_id,
-            biomarker_type=biomarker_type,
-            days=days
-        )
+    days = int(request.args.get('days', 90))
 
-        return jsonify({
-            'success': True,
-            'biomarker_type': biomarker_type,
-            'data': trend_data
-        }), 200
+    trend_data = db.get_biomarker_trend(
+        patient_id=patient_id,
+        biomarker_type=biomarker_type,
+        days=days
+    )
 
-    except Exception as e:
-        return jsonify({'error': f'Failed to retrieve biomarker trend: {str(e)}'}), 500
+    return jsonify({
+        'success': True,
+        'biomarker_type': biomarker_type,
+        'data': trend_data
+    }), 200
 
 
 # ============================================================================
@@ -229,22 +310,18 @@ def get_patient_notes(patient_id):
             "notes": [...]
         }
     """
-    try:
-        doctor = request.user
+    doctor = request.user
 
-        # Check access
-        if not db.check_doctor_access(doctor['id'], patient_id):
-            return jsonify({'error': 'Access denied to this patient'}), 403
+    # Check access
+    if not _has_patient_access(doctor['id'], patient_id):
+        return jsonify({'error': 'Access denied to this patient'}), 403
 
-        notes = db.get_patient_doctor_notes(patient_id, include_private=True)
+    notes = db.get_patient_doctor_notes(patient_id, include_private=True)
 
-        return jsonify({
-            'success': True,
-            'notes': notes
-        }), 200
-
-    except Exception as e:
-        return jsonify({'error': f'Failed to retrieve notes: {str(e)}'}), 500
+    return jsonify({
+        'success': True,
+        'notes': notes
+    }), 200
 
 
 @doctor_bp.route('/patient/<patient_id>/notes', methods=['POST'])
@@ -271,38 +348,34 @@ def add_patient_note(patient_id):
             "note": {...}
         }
     """
-    try:
-        doctor = request.user
-        data = request.get_json()
-
-        # Check access
-        if not db.check_doctor_access(doctor['id'], patient_id):
-            return jsonify({'error': 'Access denied to this patient'}), 403
-
-        # Validate required fields
-        if not data.get('note_text'):
-            return jsonify({'error': 'Note text is required'}), 400
-
-        # Create note
-        note_data = {
-            'patient_id': patient_id,
-            'doctor_id': doctor['id'],
-            'note_text': data['note_text'],
-            'note_type': data.get('note_type', 'general'),
-            'visit_date': data.get('visit_date', datetime.now().date().isoformat()),
-            'is_private': data.get('is_private', False),
-            'record_id': data.get('record_id')
-        }
+    doctor = request.user
+    data = request.get_json()
 
-        note = db.create_doctor_note(note_data)
+    # Check access
+    if not _has_patient_access(doctor['id'], patient_id):
+        return jsonify({'error': 'Access denied to this patient'}), 403
 
-        return jsonify({
-            'success': True,
-            'note': note
-        }), 201
+    # Validate required fields
+    if not data.get('note_text'):
+        return jsonify({'error': 'Note text is required'}), 400
 
-    except Exception as e:
-        return jsonify({'error': f'Failed to create note: {str(e)}'}), 500
+    # Create note
+    note_data = {
+        'patient_id': patient_id,
+        'doctor_id': doctor['id'],
+        'note_text': data['note_text'],
+        'note_type': data.get('note_type', 'general'),
+        'visit_date': data.get('visit_date', datetime.now().date().isoformat()),
+        'is_private': data.get('is_private', False),
+        'record_id': data.get('record_id')
+    }
+
+    note = db.create_doctor_note(note_data)
+
+    return jsonify({
+        'success': True,
+        'note': note
+    }), 201
 
 
 # ============================================================================
@@ -324,30 +397,21 @@ def acknowledge_anomaly(anomaly_id):
             "anomaly": {...}
         }
     """
-    try:
-        doctor = request.user
-
-        # Get anomaly to check patient access
-        anomaly = db.client.table('anomalies').select('*').eq('id', anomaly_id).execute()
-        if not anomaly.data:
-            return jsonify({'error': 'Anomaly not found'}), 404
-
-        patient_id = anomaly.data[0]['patient_id']
-
-        # Check access
-        if not db.check_doctor_access(doctor['id'], patient_id):
-            return jsonify({'error': 'Access denied'}), 403
+    doctor = request.user
 
-        # Acknowledge anomaly
-        updated_anomaly = db.acknowledge_anomaly(anomaly_id, doctor['id'])
+    # Authorization check and acknowledge happen in one db call - no
+    # separate fetch of the full anomaly row just to read patient_id
+    status, updated_anomaly = db.acknowledge_anomaly_for_doctor(anomaly_id, doctor['id'])
 
-        return jsonify({
-            'success': True,
-            'anomaly': updated_anomaly
-        }), 200
+    if status == 'not_found':
+        return jsonify({'error': 'Anomaly not found'}), 404
+    if status == 'forbidden':
+        return jsonify({'error': 'Access denied'}), 403
 
-    except Exception as e:
-        return jsonify({'error': f'Failed to acknowledge anomaly: {str(e)}'}), 500
+    return jsonify({
+        'success': True,
+        'anomaly': updated_anomaly
+    }), 200
 
 
 @doctor_bp.route('/patient/<patient_id>/anomalies', methods=['GET'])
@@ -369,29 +433,25 @@ def get_patient_anomalies(patient_id):
             "anomalies": [...]
         }
     """
-    try:
-        doctor = request.user
+    doctor = request.user
 
-        # Check access
-        if not db.check_doctor_access(doctor['id'], patient_id):
-            return jsonify({'error': 'Access denied to this patient'}), 403
+    # Check access
+    if not _has_patient_access(doctor['id'], patient_id):
+        return jsonify({'error': 'Access denied to this patient'}), 403
 
-        critical_only = request.args.get('critical_only', 'false').lower() == 'true'
-        unacknowledged_only = request.args.get('unacknowledged_only', 'false').lower() == 'true'
+    critical_only = request.args.get('critical_only', 'false').lower() == 'true'
+    unacknowledged_only = request.args.get('unacknowledged_only', 'false').lower() == 'true'
 
-        anomalies = db.get_patient_anomalies(
-            patient_id=patient_id,
-            critical_only=critical_only,
-            unacknowledged_only=unacknowledged_only
-        )
+    anomalies = db.get_patient_anomalies(
+        patient_id=patient_id,
+        critical_only=critical_only,
+        unacknowledged_only=unacknowledged_only
+    )
 
-        return jsonify({
-            'success': True,
-            'anomalies': anomalies
-        }), 200
-
-    except Exception as e:
-        return jsonify({'error': f'Failed to retrieve anomalies: {str(e)}'}), 500
+    return jsonify({
+        'success': True,
+        'anomalies': anomalies
+    }), 200
 
 
 # ============================================================================
@@ -421,38 +481,34 @@ def request_patient_access():
             "message": "Access request sent to patient"
         }
     """
-    try:
-        doctor = request.user
-        data = request.get_json()
-
-        patient_email = data.get('patient_email')
-        if not patient_email:
-            return jsonify({'error': 'Patient email is required'}), 400
+    doctor = request.user
+    data = request.get_json()
 
-        # Get patient
-        patient = db.get_user_by_email(patient_email)
-        if not patient:
-            return jsonify({'error': 'Patient not found'}), 404
+    patient_email = data.get('patient_email')
+    if not patient_email:
+        return jsonify({'error': 'Patient email is required'}), 400
 
-        if patient['user_type'] != 'patient':
-            return jsonify({'error': 'User is not a patient'}), 400
+    # Get patient
+    patient = db.get_user_by_email(patient_email)
+    if not patient:
+        return jsonify({'error': 'Patient not found'}), 404
 
-        # Check if access already exists
-        existing_access = db.check_doctor_access(doctor['id'], patient['id'])
-        if existing_access:
-            return jsonify({'error': 'You already have access to this patient'}), 400
+    if patient['user_type'] != 'patient':
+        return jsonify({'error': 'User is not a patient'}), 400
 
-        # In production, this would send a notification/email to the patient
-        # For now, we'll just return a success message
+    # Check if access already exists
+    existing_access = db.check_doctor_access(doctor['id'], patient['id'])
+    if existing_access:
+        return jsonify({'error': 'You already have access to this patient'}), 400
 
-        return jsonify({
-            'success': True,
-            'message': 'Access request sent to patient',
-            'patient_id': patient['id']
-        }), 200
+    # In production, this would send a notification/email to the patient
+    # For now, we'll just return a success message
 
-    except Exception as e:
-        return jsonify({'error': f'Failed to request access: {str(e)}'}), 500
+    return jsonify({
+        'success': True,
+        'message': 'Access request sent to patient',
+        'patient_id': patient['id']
+    }), 200
 
 
 # ============================================================================
@@ -480,31 +536,20 @@ def search_patients():
             "patients": [...]
         }
     """
-    try:
-        doctor = request.user
-        data = request.get_json()
-
-        query = data.get('query', '').lower()
-        if not query:
-            return jsonify({'error': 'Query is required'}), 400
+    doctor = request.user
+    data = request.get_json()
 
-        # Get accessible patients
-        accessible_patients = db.get_doctor_patients(doctor['id'])
+    query = data.get('query', '').lower()
+    if not query:
+        return jsonify({'error': 'Query is required'}), 400
 
-        # Filter by query
-        filtered_patients = [
-            p for p in accessible_patients
-            if query in p.get('full_name', '').lower() or
-               query in p.get('email', '').lower()
-        ]
+    # Substring filter runs in the database; only matches come back
+    filtered_patients = db.search_accessible_patients(doctor['id'], query)
 
-        return jsonify({
-            'success': True,
-            'patients': filtered_patients
-        }), 200
-
-    except Exception as e:
-        return jsonify({'error': f'Failed to search patients: {str(e)}'}), 500
+    return jsonify({
+        'success': True,
+        'patients': filtered_patients
+    }), 200
 
 
 # ============================================================================
@@ -531,46 +576,39 @@ def get_dashboard_stats():
             }
         }
     """
-    try:
-        doctor = request.user
-
-        # Get accessible patients
-        accessible_patients = db.get_doctor_patients(doctor['id'])
-        total_patients = len(accessible_patients)
-
-        # Get patients with critical alerts
-        patients_with_alerts = []
-        total_critical_alerts = 0
-
-        for patient_access in accessible_patients:
-            patient_id = patient_access.get('patient_id')
-            if patient_id:
-                critical_anomalies = db.get_patient_anomalies(
-                    patient_id=patient_id,
-                    critical_only=True,
-                    unacknowledged_only=True
-                )
-
-                if critical_anomalies:
-                    total_critical_alerts += len(critical_anomalies)
-                    patients_with_alerts.append({
-                        'patient_id': patient_id,
-                        'patient_name': patient_access.get('full_name', 'Unknown'),
-                        'alert_count': len(critical_anomalies),
-                        'most_severe': max(critical_anomalies, key=lambda x: x.get('severity', 0))
-                    })
-
-        # Sort patients by alert count
-        patients_with_alerts.sort(key=lambda x: x['alert_count'], reverse=True)
-
-        return jsonify({
-            'success': True,
-            'stats': {
-                'total_patients': total_patients,
-                'critical_alerts': total_critical_alerts,
-                'patients_with_alerts': patients_with_alerts[:10],  # Top 10
-            }
-        }), 200
-
-    except Exception as e:
-        return jsonify({'error': f'Failed to retrieve dashboard stats: {str(e)}'}), 500
+    doctor = request.user
+
+    # Get accessible patients - the full roster, not a page: the
+    # totals below must cover every patient
+    accessible_patients = db.get_doctor_patients(doctor['id'], limit=None)
+    total_patients = len(accessible_patients)
+
+    # Per-patient counts and most-severe rows are aggregated in SQL -
+    # one batched query, no Python scan over anomaly lists
+    patient_ids = [p['patient_id'] for p in accessible_patients if p.get('patient_id')]
+    alert_summary = db.get_critical_alert_summary(patient_ids)
+
+    patients_with_alerts = []
+    total_critical_alerts = sum(s['alert_count'] for s in alert_summary.values())
+
+    for patient_access in accessible_patients:
+        summary = alert_summary.get(patient_access.get('patient_id'))
+        if summary:
+            patients_with_alerts.append({
+                'patient_id': patient_access['patient_id'],
+                'patient_name': patient_access.get('full_name', 'Unknown'),
+                'alert_count': summary['alert_count'],
+                'most_severe': summary['most_severe']
+            })
+
+    # Sort patients by alert count
+    patients_with_alerts.sort(key=lambda x: x['alert_count'], reverse=True)
+
+    return jsonify({
+        'success': True,
+        'stats': {
+            'total_patients': total_patients,
+            'critical_alerts': total_critical_alerts,
+            'patients_with_alerts': patients_with_alerts[:10],  # Top 10
+        }
+    }), 200
@@ -3,10 +3,16 @@ Medical Records API Endpoints for MediVault
 Handles patient record operations: upload, retrieve, search
 """
 
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify, send_file, Response
 from werkzeug.utils import secure_filename
 from datetime import datetime
+import hashlib
+import logging
+import logging.handlers
 import os
+import queue
+import uuid
+import orjson
 from pathlib import Path
 
 from api.auth import require_auth
@@ -19,6 +25,17 @@ from config import Config
 # Create blueprint
 records_bp = Blueprint('records', __name__, url_prefix='/api/records')
 
+# Error logging goes through a queue drained by a background thread -
+# formatting and stdout writes happen off the request workers, so an
+# error burst during uploads doesn't serialize every handler on I/O
+logger = logging.getLogger(__name__)
+if not logger.handlers:
+    _log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+    logger.propagate = False
+    _log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+    _log_listener.start()
+
 # Get services
 db = get_database()
 cache = get_cache_service()
@@ -39,12 +56,93 @@ except Exception as e:
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
+    ext = os.path.splitext(filename)[1][1:].lower()
+    return bool(ext) and ext in Config.ALLOWED_EXTENSIONS
+
+
+# Insert-row shapes for extracted entities: column defaults plus the
+# extraction-key -> column renames. Rows are built by one dict merge per
+# entity instead of a chain of per-field .get() calls - for a lab report
+# with dozens of biomarkers that's a measurable cut in per-upload CPU.
+_BIOMARKER_DEFAULTS = {
+    'biomarker_type': 'unknown', 'value': 0, 'unit': '',
+    'normal_min': None, 'normal_max': None, 'is_abnormal': False,
+    'extracted_text': '', 'confidence': 0.0
+}
+_BIOMARKER_RENAMES = {'type': 'biomarker_type'}
+
+_MEDICATION_DEFAULTS = {
+    'medication_name': 'Unknown', 'dosage': '', 'frequency': '',
+    'duration': '', 'extracted_text': '', 'confidence': 0.0
+}
+_MEDICATION_RENAMES = {'name': 'medication_name'}
+
+_DISEASE_DEFAULTS = {
+    'disease_name': 'Unknown', 'status': 'active',
+    'extracted_text': '', 'confidence': 0.0
+}
+_DISEASE_RENAMES = {'name': 'disease_name'}
+
+_ANOMALY_DEFAULTS = {
+    'anomaly_type': 'unknown', 'layer': 'unknown', 'severity': 0,
+    'title': '', 'message': '', 'recommendation': '',
+    'affected_biomarker': None
+}
+_ANOMALY_RENAMES = {'type': 'anomaly_type', 'biomarker': 'affected_biomarker'}
+
+
+def _rows_from_entities(entities, defaults, renames, base):
+    """Build insert rows from extracted entities via dict merges"""
+    rows = []
+    for entity in entities:
+        row = {**defaults, **base}
+        for key, value in entity.items():
+            column = renames.get(key, key)
+            if column in defaults and value is not None:
+                row[column] = value
+        rows.append(row)
+    return rows
+
+
+def _cache_get_or_set(key, ttl, fn):
+    """
+    Serve a query result from Redis, computing and storing it on miss
+
+    Dashboard polling re-issues the same biomarker/anomaly queries every
+    few seconds; a short TTL turns most of those into cache hits. Keys
+    live under the patient:{id}: namespace so the existing upload-time
+    invalidation sweeps them too.
+    """
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    value = fn()
+    cache.set(key, value, expire_seconds=ttl)
+    return value
+
+
+def _search_result_hash(results):
+    """
+    Fingerprint a search result set by its record IDs (order-independent)
+
+    Search hits carry record_id (not id). Returns None when no result
+    has one, so callers skip the summary cache instead of colliding on
+    a fingerprint that no longer depends on which records matched.
+    """
+    ids = sorted(str(r['record_id']) for r in results if r.get('record_id'))
+    if not ids:
+        return None
+    return hashlib.sha1(','.join(ids).encode()).hexdigest()
 
 
 def save_uploaded_file(file, patient_id):
-    """Save uploaded file and return file path"""
+    """
+    Stream uploaded file to disk and return (filepath, filename, size, sha256)
+
+    The file is written in 1 MiB chunks with the byte count and SHA-256
+    computed in the same pass - file.content_length is often None for
+    chunked uploads, and the hash enables content-based dedup.
+    """
     if not file or file.filename == '':
         raise ValueError("No file provided")
 
@@ -55,16 +153,24 @@ def save_uploaded_file(file, patient_id):
     upload_dir = Path(Config.UPLOAD_FOLDER) / patient_id
     upload_dir.mkdir(parents=True, exist_ok=True)
 
-    # Generate unique filename
-    filename = secure_filename(file.filename)
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"{timestamp}_{filename}"
+    # Generate unique filename - a UUID prefix can't collide, unlike the
+    # old second-resolution timestamp, and skips the strftime call
+    filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
     filepath = upload_dir / filename
 
-    # Save file
-    file.save(str(filepath))
+    # Stream to disk, counting bytes and hashing as we go
+    hasher = hashlib.sha256()
+    size = 0
+    with open(filepath, 'wb') as out:
+        while True:
+            chunk = file.stream.read(1 << 20)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            size += len(chunk)
+            out.write(chunk)
 
-    return str(filepath), filename, file.content_length
+    return str(filepath), filename, size, hasher.hexdigest()
 
 
 # ============================================================================
@@ -104,7 +210,20 @@ def upload_record():
         user = request.user
 
         # Save file
-        filepath, filename, file_size = save_uploaded_file(file, user['id'])
+        filepath, filename, file_size, content_hash = save_uploaded_file(file, user['id'])
+
+        # Dedup: same bytes already uploaded by this patient - return
+        # the existing record instead of reprocessing
+        existing = db.get_record_by_content_hash(user['id'], content_hash)
+        if existing:
+            os.remove(filepath)
+            return jsonify({
+                'success': True,
+                'record_id': existing['id'],
+                'record': existing,
+                'processing_result': {'cached': True},
+                'duplicate': True
+            }), 200
 
         # Get metadata from form
         document_type = request.form.get('document_type')
@@ -113,7 +232,9 @@ def upload_record():
         issuing_doctor = request.form.get('issuing_doctor')
 
         # Generate record ID
-        record_id = f"REC_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        # record_id is UNIQUE in the db - two uploads in the same second
+        # used to collide on the timestamp form
+        record_id = f"REC_{uuid.uuid4().hex[:16]}"
 
         # Create medical record entry
         record_data = {
@@ -123,6 +244,7 @@ def upload_record():
             'file_path': filepath,
             'file_type': filename.rsplit('.', 1)[1].lower(),
             'file_size': file_size,
+            'content_hash': content_hash,
             'document_type': document_type,
             'document_date': document_date,
             'issuing_hospital': issuing_hospital,
@@ -142,8 +264,7 @@ def upload_record():
 
             processing_result = ingestion_pipeline.process_document(filepath, patient_info)
 
-            import logging
-            logging.info(f"Processing result: {processing_result}")
+            logger.debug("Processing result: %s", processing_result)
 
             # Update medical record with processing results
             updates = {
@@ -155,97 +276,52 @@ def upload_record():
                 'processing_status': 'completed'
             }
 
-            medical_record = db.update_medical_record(medical_record['id'], updates)
-
-            # Save biomarkers
-            biomarkers = processing_result.get('biomarkers', [])
-            if biomarkers:
-                biomarker_records = []
-                for biomarker in biomarkers:
-                    biomarker_records.append({
-                        'record_id': medical_record['id'],
-                        'patient_id': user['id'],
-                        'biomarker_type': biomarker.get('type', 'unknown'),
-                        'value': biomarker.get('value', 0),
-                        'unit': biomarker.get('unit', ''),
-                        'normal_min': biomarker.get('normal_min'),
-                        'normal_max': biomarker.get('normal_max'),
-                        'is_abnormal': biomarker.get('is_abnormal', False),
-                        'measurement_date': document_date or datetime.now().date().isoformat(),
-                        'extracted_text': biomarker.get('extracted_text', ''),
-                        'confidence': biomarker.get('confidence', 0.0)
-                    })
-
-                if biomarker_records:
-                    db.create_biomarkers_bulk(biomarker_records)
-
-            # Save medications
-            medications = processing_result.get('medications', [])
-            if medications:
-                medication_records = []
-                for med in medications:
-                    medication_records.append({
-                        'record_id': medical_record['id'],
-                        'patient_id': user['id'],
-                        'medication_name': med.get('name', 'Unknown'),
-                        'dosage': med.get('dosage', ''),
-                        'frequency': med.get('frequency', ''),
-                        'duration': med.get('duration', ''),
-                        'prescribed_date': document_date or datetime.now().date().isoformat(),
-                        'extracted_text': med.get('extracted_text', ''),
-                        'confidence': med.get('confidence', 0.0)
-                    })
-
-                if medication_records:
-                    db.create_medications_bulk(medication_records)
-
-            # Save diseases
-            diseases = processing_result.get('diseases', [])
-            if diseases:
-                disease_records = []
-                for disease in diseases:
-                    disease_records.append({
-                        'record_id': medical_record['id'],
-                        'patient_id': user['id'],
-                        'disease_name': disease.get('name', 'Unknown'),
-                        'diagnosed_date': document_date or datetime.now().date().isoformat(),
-                        'status': 'active',
-                        'extracted_text': disease.get('extracted_text', ''),
-                        'confidence': disease.get('confidence', 0.0)
-                    })
-
-                if disease_records:
-                    db.create_diseases_bulk(disease_records)
-
-            # Save anomalies
-            anomaly_detection = processing_result.get('anomaly_detection', {})
-            anomalies = anomaly_detection.get('anomalies', [])
-            if anomalies:
-                anomaly_records = []
-                for anomaly in anomalies:
-                    anomaly_records.append({
-                        'record_id': medical_record['id'],
-                        'patient_id': user['id'],
-                        'anomaly_type': anomaly.get('type', 'unknown'),
-                        'layer': anomaly.get('layer', 'unknown'),
-                        'severity': anomaly.get('severity', 0),
-                        'is_critical': anomaly.get('severity', 0) >= 80,
-                        'title': anomaly.get('title', ''),
-                        'message': anomaly.get('message', ''),
-                        'recommendation': anomaly.get('recommendation', ''),
-                        'affected_biomarker': anomaly.get('biomarker')
-                    })
-
-                if anomaly_records:
-                    db.create_anomalies_bulk(anomaly_records)
+            # Build all child rows first, then persist everything -
+            # record update plus bulk inserts - in a single transaction
+            default_date = document_date or datetime.now().date().isoformat()
+
+            base_child = {'record_id': medical_record['id'], 'patient_id': user['id']}
+
+            biomarker_records = _rows_from_entities(
+                processing_result.get('biomarkers', []),
+                _BIOMARKER_DEFAULTS, _BIOMARKER_RENAMES,
+                {**base_child, 'measurement_date': default_date}
+            )
+
+            medication_records = _rows_from_entities(
+                processing_result.get('medications', []),
+                _MEDICATION_DEFAULTS, _MEDICATION_RENAMES,
+                {**base_child, 'prescribed_date': default_date}
+            )
+
+            disease_records = _rows_from_entities(
+                processing_result.get('diseases', []),
+                _DISEASE_DEFAULTS, _DISEASE_RENAMES,
+                {**base_child, 'diagnosed_date': default_date}
+            )
+
+            anomaly_records = _rows_from_entities(
+                processing_result.get('anomaly_detection', {}).get('anomalies', []),
+                _ANOMALY_DEFAULTS, _ANOMALY_RENAMES,
+                base_child
+            )
+            for row in anomaly_records:
+                row['is_critical'] = row['severity'] >= 80
+
+            medical_record = db.persist_ingestion_result(
+                medical_record['id'],
+                updates,
+                biomarker_records,
+                medication_records,
+                anomaly_records,
+                diseases=disease_records
+            )
 
             # Invalidate patient cache
             cache.invalidate_patient_cache(user['id'])
 
         except Exception as e:
-            print(f"Processing error: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Document processing failed")
             db.update_medical_record(medical_record['id'], {
                 'processing_status': 'failed',
                 'error_message': str(e)
@@ -299,23 +375,19 @@ def get_all_records():
         order_by = request.args.get('order_by', 'created_at')
 
         # Try cache first
-        cache_key = f"patient:{user['id']}:records:{limit}:{offset}"
+        cache_key = f"patient:{user['id']}:records:{limit}:{offset}:{order_by}"
         cached_records = cache.get(cache_key)
         if cached_records:
             return jsonify(cached_records), 200
 
-        # Get records from database
-        records = db.get_patient_records(
+        # Get records plus exact total in one query (COUNT(*) OVER())
+        records, total = db.get_patient_records(
             patient_id=user['id'],
             limit=limit,
             offset=offset,
             order_by=order_by
         )
 
-        # Get total count (for pagination)
-        # In production, use a separate count query
-        total = len(records) + offset
-
         result = {
             'success': True,
             'records': records,
@@ -355,32 +427,22 @@ def get_record(record_id):
     try:
         user = request.user
 
-        # Get record
-        record = db.get_record_by_id(record_id)
-        if not record:
+        # Record and related entities come back from a single db call
+        bundle = db.get_record_with_children(record_id)
+        if not bundle:
             return jsonify({'error': 'Record not found'}), 404
 
         # Check access permissions - user must own this record
-        if record['patient_id'] != user['id']:
+        if bundle['record']['patient_id'] != user['id']:
             return jsonify({'error': 'Access denied'}), 403
 
-        # Get related data using SQLite methods
-        biomarkers = db.get_record_biomarkers(record_id)
-        medications = db.get_record_medications(record_id)
-        anomalies = db.get_record_anomalies(record_id)
-
         return jsonify({
             'success': True,
-            'record': record,
-            'biomarkers': biomarkers,
-            'medications': medications,
-            'anomalies': anomalies
+            **bundle
         }), 200
 
     except Exception as e:
-        print(f"Error in get_record: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Failed to retrieve record")
         return jsonify({'error': f'Failed to retrieve record: {str(e)}'}), 500
 
 
@@ -413,14 +475,20 @@ def download_record(record_id):
         if not os.path.exists(file_path):
             return jsonify({'error': 'File not found'}), 404
 
-        return send_file(
+        # conditional=True turns on ETag/Last-Modified revalidation and
+        # Range requests, so repeat downloads get 304s and resumed ones
+        # only transfer the missing bytes
+        response = send_file(
             file_path,
             as_attachment=True,
-            download_name=record['file_name']
+            download_name=record['file_name'],
+            conditional=True
         )
+        response.headers['Cache-Control'] = 'private, max-age=3600'
+        return response
 
     except Exception as e:
-        print(f"Error in download_record: {e}")
+        logger.exception("Download failed")
         return jsonify({'error': f'Download failed: {str(e)}'}), 500
 
 
@@ -466,11 +534,24 @@ def search_records():
         generate_summary = data.get('generate_summary', True)
         n_results = min(int(data.get('n_results', 10)), 50)  # Max 50
 
-        # Try cache first
-        cache_key = f"search:{query}:patient:{user['id']}:{search_type}:{n_results}"
-        cached_results = cache.get(cache_key)
-        if cached_results and not generate_summary:
-            return jsonify(cached_results), 200
+        # Search hits and LLM summaries are cached separately: hits are
+        # keyed by query params, summaries by the result set they
+        # describe, so a summary request can still reuse cached hits
+        results_key = f"search:{query}:patient:{user['id']}:{search_type}:{n_results}"
+        cached_results = cache.get(results_key)
+        if cached_results:
+            if not generate_summary:
+                return jsonify(cached_results), 200
+
+            result_hash = _search_result_hash(cached_results.get('results', []))
+            cached_summary = (cache.get(f"summary:{user['id']}:{result_hash}")
+                              if result_hash else None)
+            if cached_summary:
+                return jsonify({
+                    **cached_results,
+                    'ai_summary': cached_summary.get('ai_summary'),
+                    'tokens_used': cached_summary.get('tokens_used', 0)
+                }), 200
 
         # Perform search
         results = search_pipeline.search(
@@ -489,8 +570,19 @@ def search_records():
             'tokens_used': results.get('llm_metadata', {}).get('tokens_used', 0)
         }
 
-        # Cache results
-        cache.set(cache_key, response, expire_seconds=600)  # 10 minutes
+        # Cache hits without the summary (10 minutes)
+        cache.set(results_key, {**response, 'ai_summary': None, 'tokens_used': 0},
+                  expire_seconds=600)
+
+        # Cache the summary against its result set (1 hour)
+        if generate_summary and response['ai_summary']:
+            result_hash = _search_result_hash(response['results'])
+            if result_hash:
+                cache.set(
+                    f"summary:{user['id']}:{result_hash}",
+                    {'ai_summary': response['ai_summary'], 'tokens_used': response['tokens_used']},
+                    expire_seconds=3600
+                )
 
         return jsonify(response), 200
 
@@ -576,10 +668,14 @@ def get_anomalies():
         critical_only = request.args.get('critical_only', 'false').lower() == 'true'
         unacknowledged_only = request.args.get('unacknowledged_only', 'false').lower() == 'true'
 
-        anomalies = db.get_patient_anomalies(
-            patient_id=user['id'],
-            critical_only=critical_only,
-            unacknowledged_only=unacknowledged_only
+        anomalies = _cache_get_or_set(
+            f"patient:{user['id']}:anomalies:{int(critical_only)}:{int(unacknowledged_only)}",
+            60,
+            lambda: db.get_patient_anomalies(
+                patient_id=user['id'],
+                critical_only=critical_only,
+                unacknowledged_only=unacknowledged_only
+            )
         )
 
         return jsonify({
@@ -619,10 +715,14 @@ def get_biomarkers():
         biomarker_type = request.args.get('type')
         limit = min(int(request.args.get('limit', 50)), 100)
 
-        biomarkers = db.get_patient_biomarkers(
-            patient_id=user['id'],
-            biomarker_type=biomarker_type,
-            limit=limit
+        biomarkers = _cache_get_or_set(
+            f"patient:{user['id']}:biomarkers:{biomarker_type}:{limit}",
+            60,
+            lambda: db.get_patient_biomarkers(
+                patient_id=user['id'],
+                biomarker_type=biomarker_type,
+                limit=limit
+            )
         )
 
         return jsonify({
@@ -657,14 +757,11 @@ def get_biomarker_trend(biomarker_type):
         user = request.user
         days = int(request.args.get('days', 90))
 
-        # Try cache first
-        cached_trend = cache.get_biomarker_trend(user['id'], biomarker_type)
-        if cached_trend:
-            return jsonify({
-                'success': True,
-                'biomarker_type': biomarker_type,
-                'data': cached_trend
-            }), 200
+        # Try cache first - the cached value is the finished JSON body,
+        # so a hit skips serialization entirely
+        cached_body = cache.get_biomarker_trend(user['id'], biomarker_type)
+        if cached_body:
+            return Response(cached_body, mimetype='application/json'), 200
 
         # Get trend data
         trend_data = db.get_biomarker_trend(
@@ -673,14 +770,15 @@ def get_biomarker_trend(biomarker_type):
             days=days
         )
 
-        # Cache result
-        cache.cache_biomarker_trend(user['id'], biomarker_type, trend_data, expire_minutes=30)
-
-        return jsonify({
+        # Serialize once, cache the bytes, return them directly
+        body = orjson.dumps({
             'success': True,
             'biomarker_type': biomarker_type,
             'data': trend_data
-        }), 200
+        })
+        cache.cache_biomarker_trend(user['id'], biomarker_type, body, expire_minutes=30)
+
+        return Response(body, mimetype='application/json'), 200
 
     except Exception as e:
         return jsonify({'error': f'Failed to retrieve biomarker trend: {str(e)}'}), 500
@@ -722,3 +820,38 @@ def get_summary():
 
     except Exception as e:
         return jsonify({'error': f'Failed to retrieve summary: {str(e)}'}), 500
+
+
+@records_bp.route('/dashboard', methods=['GET'])
+@require_auth
+def get_dashboard():
+    """
+    Get summary, anomalies, and biomarkers in one call
+
+    The patient dashboard needs all three on page load; this endpoint
+    replaces three sequential requests (and three DB trips) with one.
+    The individual endpoints remain for callers that want a single slice.
+
+    Headers:
+        Authorization: Bearer <token>
+
+    Returns:
+        {
+            "success": true,
+            "summary": {...},
+            "anomalies": [...],
+            "biomarkers": [...]
+        }
+    """
+    try:
+        user = request.user
+
+        dashboard = db.get_dashboard(user['id'])
+
+        return jsonify({
+            'success': True,
+            **dashboard
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to retrieve dashboard: {str(e)}'}), 500
@@ -60,7 +60,10 @@ class Config:
     # File Upload Configuration
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
     MAX_FILE_SIZE_MB = int(os.getenv('MAX_FILE_SIZE_MB', '16'))
-    ALLOWED_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png', 'tiff', 'bmp'}
+    # Offload downloads to the front proxy (nginx X-Accel-Redirect /
+    # Apache X-Sendfile) instead of streaming bytes through Python
+    USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'
+    ALLOWED_EXTENSIONS = frozenset({'pdf', 'jpg', 'jpeg', 'png', 'tiff', 'bmp'})
 
     # Supabase Storage
     STORAGE_BUCKET_NAME = os.getenv('STORAGE_BUCKET_NAME', 'medical-records')
@@ -87,12 +90,19 @@ class Config:
 
         return True
 
+    # Sentinel so repeat imports skip the stat+mkdir syscalls; without
+    # --preload every gunicorn worker runs this import-time setup
+    _dirs_ready = False
+
     @classmethod
     def setup_directories(cls):
-        """Create necessary directories if they don't exist"""
-        cls.LOGS_DIR.mkdir(exist_ok=True)
-        cls.DATA_DIR.mkdir(exist_ok=True)
-        Path(cls.VECTOR_DB_PATH).mkdir(exist_ok=True)
+        """Create necessary directories if they don't exist (once per process)"""
+        if cls._dirs_ready:
+            return
+        cls.LOGS_DIR.mkdir(parents=True, exist_ok=True)
+        cls.DATA_DIR.mkdir(parents=True, exist_ok=True)
+        Path(cls.VECTOR_DB_PATH).mkdir(parents=True, exist_ok=True)
+        cls._dirs_ready = True
 
 
 # Auto-setup directories on import
@@ -5,23 +5,29 @@ Simple authentication-focused implementation
 
 import os
 import sqlite3
+import threading
+import time
 import uuid
-import json
+import orjson
 import numpy as np
 
-class NpEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        if isinstance(obj, np.floating):
-            return float(obj)
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return super(NpEncoder, self).default(obj)
-from typing import Dict, List, Optional, Any
+from functools import lru_cache
+from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime, timedelta
 from pathlib import Path
 
+# Placeholder strings ('?, ?, ...') memoized by count - IN clauses and
+# bulk inserts ask for the same handful of widths over and over, and a
+# dict hit is cheaper than re-joining the string each time
+_PH_CACHE: Dict[int, str] = {}
+
+def _ph(n: int) -> str:
+    """Return a cached comma-joined string of n '?' placeholders"""
+    ph = _PH_CACHE.get(n)
+    if ph is None:
+        ph = _PH_CACHE[n] = ', '.join(['?'] * n)
+    return ph
+
 class Database:
     """
     SQLite database interface for MediSense
@@ -37,9 +43,70 @@ class Database:
         self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
         self.conn.row_factory = sqlite3.Row  # Return rows as dictionaries
 
+        # WAL lets readers see a consistent snapshot while one writer
+        # commits, and synchronous=NORMAL drops the per-commit fsync of
+        # the main database file - the single-row create_* inserts were
+        # I/O-bound on that. The 64 MB page cache and mmap keep hot
+        # pages out of the read syscall path.
+        self.conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA cache_size=-65536;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+            PRAGMA busy_timeout=5000;
+            PRAGMA foreign_keys=ON;
+        """)
+
+        # The connection is shared across request threads
+        # (check_same_thread=False); writes serialize on this lock so an
+        # execute/commit pair from one thread can't interleave with
+        # another's statement
+        self._write_lock = threading.RLock()
+
+        # Callers pass the same key sets on almost every call, so the
+        # rendered INSERT/UPDATE strings are cached by (table, keys):
+        # repeat calls skip the join/format work and hand SQLite an
+        # identical string, keeping its prepared-statement cache warm
+        self._insert_sql_cache: Dict[tuple, str] = {}
+        self._update_sql_cache: Dict[tuple, str] = {}
+
+        # Per-instance LRU caches over the primary-key lookups: every
+        # authenticated request re-reads its user row and most record
+        # endpoints re-read the record they just listed. A repeat hit
+        # skips the whole statement execution. Cleared wholesale
+        # whenever the corresponding table is written - but that clear
+        # is per-process, and deployments run several gunicorn workers,
+        # so each entry also carries a time-bucket epoch in its key
+        # (see _cache_epoch): a write handled by another worker is
+        # visible everywhere within CACHE_TTL seconds.
+        self._user_by_id_cached = lru_cache(maxsize=512)(self._fetch_user_by_id)
+        self._user_by_email_cached = lru_cache(maxsize=512)(self._fetch_user_by_email)
+        self._record_by_id_cached = lru_cache(maxsize=512)(self._fetch_record_by_id)
+
+        # One writer, many readers: SELECTs go through per-thread
+        # read-only connections (see _read_conn) so WAL's concurrent
+        # readers are actually usable - on the shared connection every
+        # read serialized behind SQLite's connection mutex and whatever
+        # write was holding it
+        self._read_local = threading.local()
+
         # Initialize tables
         self._init_tables()
 
+    # Upper bound on how long another worker can serve a row cached
+    # before this process wrote it
+    CACHE_TTL = 30  # seconds
+
+    def _cache_epoch(self) -> int:
+        """Time bucket folded into LRU keys so entries expire in CACHE_TTL"""
+        return int(time.monotonic() / self.CACHE_TTL)
+
+    def _invalidate_user_cache(self):
+        """Drop cached user rows after any users-table write"""
+        self._user_by_id_cached.cache_clear()
+        self._user_by_email_cached.cache_clear()
+
     def _init_tables(self):
         """Create database tables if they don't exist"""
         cursor = self.conn.cursor()
@@ -92,12 +159,12 @@ class Database:
                 file_path TEXT NOT NULL,
                 file_type TEXT NOT NULL,
                 file_size INTEGER,
+                content_hash TEXT,
                 document_type TEXT,
                 document_date TEXT,
                 issuing_hospital TEXT,
                 issuing_doctor TEXT,
                 ocr_text TEXT,
-                ocr_confidence REAL,
                 processing_status TEXT DEFAULT 'pending',
                 clinical_summary TEXT,
                 overall_severity INTEGER DEFAULT 0,
@@ -177,176 +244,203 @@ class Database:
             )
         """)
 
+        # Create doctor_access table (trimmed-down version of the
+        # Postgres reference schema - the columns this code reads)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS doctor_access (
+                id TEXT PRIMARY KEY,
+                patient_id TEXT NOT NULL,
+                doctor_id TEXT NOT NULL,
+                access_level TEXT DEFAULT 'read',
+                is_active INTEGER DEFAULT 1,
+                revoked_at TEXT,
+                revoked_by TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (patient_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY (doctor_id) REFERENCES users(id) ON DELETE CASCADE,
+                UNIQUE (patient_id, doctor_id)
+            )
+        """)
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_doctor_access_doctor_patient
+            ON doctor_access(doctor_id, patient_id)
+        """)
+
+        # Compound indexes matching the hot query patterns: paginated
+        # record lists, per-patient biomarker trends, anomaly feeds, and
+        # a partial index for the unacknowledged-critical dashboard query
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_medical_records_patient_created
+            ON medical_records(patient_id, created_at DESC)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_medical_records_patient_severity
+            ON medical_records(patient_id, overall_severity DESC)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_biomarkers_patient_type_date
+            ON biomarkers(patient_id, biomarker_type, measurement_date DESC)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_anomalies_patient_detection
+            ON anomalies(patient_id, detection_date DESC)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_anomalies_critical_unack
+            ON anomalies(patient_id)
+            WHERE is_critical = 1 AND acknowledged = 0
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_biomarkers_record_id
+            ON biomarkers(record_id)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_medications_record_id
+            ON medications(record_id)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_anomalies_record_id
+            ON anomalies(record_id)
+        """)
+        # Partial index: get_critical_records only ever scans flagged
+        # rows, so indexing just those keeps it tiny
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_medical_records_critical
+            ON medical_records(patient_id, created_at DESC)
+            WHERE has_critical_alerts = 1
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_medications_patient_prescribed
+            ON medications(patient_id, prescribed_date DESC)
+        """)
+
+        # Refresh planner statistics so the new indexes are actually
+        # chosen over table scans
+        cursor.execute("ANALYZE")
+
         self.conn.commit()
-        self._add_patient_age_column()
-        self._add_date_column()
-        self._add_domain_info_column()
-        self._add_diseases_column()
-        self._add_medications_column()
-        self._add_biomarkers_column()
-        self._add_symptoms_column()
-        self._add_procedures_column()
-        self._add_anomaly_detection_column()
-        self._add_ocr_confidence_column()
-        self._add_llm_metadata_column()
-        self._add_historical_biomarkers_column()
+        self._init_search_index()
+        self._migrate_medical_records()
         print("✓ Local SQLite database initialized with all tables")
 
-    def _add_patient_age_column(self):
-        """Add patient_age column to medical_records table if it doesn't exist."""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("PRAGMA table_info(medical_records)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'patient_age' not in columns:
-                cursor.execute("ALTER TABLE medical_records ADD COLUMN patient_age INTEGER")
-                self.conn.commit()
-                print("✓ Added 'patient_age' column to 'medical_records' table.")
-        except Exception as e:
-            print(f"Error checking/adding patient_age column: {e}")
+    def _init_search_index(self):
+        """
+        Create the FTS5 full-text index over record text if missing.
 
-    def _add_date_column(self):
-        """Add date column to medical_records table if it doesn't exist."""
+        The keyword leg of search used to LIKE-scan ocr_text across all of
+        a patient's records; the external-content FTS table turns that
+        into an inverted-index lookup. Triggers keep it in sync with
+        medical_records.
+        """
         try:
             cursor = self.conn.cursor()
-            cursor.execute("PRAGMA table_info(medical_records)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'date' not in columns:
-                cursor.execute("ALTER TABLE medical_records ADD COLUMN date TEXT")
-                self.conn.commit()
-                print("✓ Added 'date' column to 'medical_records' table.")
-        except Exception as e:
-            print(f"Error checking/adding date column: {e}")
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'medical_records_fts'"
+            )
+            fts_existed = cursor.fetchone() is not None
+
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS medical_records_fts
+                USING fts5(ocr_text, clinical_summary,
+                           content='medical_records', content_rowid='rowid')
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS medical_records_fts_insert
+                AFTER INSERT ON medical_records BEGIN
+                    INSERT INTO medical_records_fts(rowid, ocr_text, clinical_summary)
+                    VALUES (new.rowid, new.ocr_text, new.clinical_summary);
+                END
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS medical_records_fts_delete
+                AFTER DELETE ON medical_records BEGIN
+                    INSERT INTO medical_records_fts(medical_records_fts, rowid, ocr_text, clinical_summary)
+                    VALUES ('delete', old.rowid, old.ocr_text, old.clinical_summary);
+                END
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS medical_records_fts_update
+                AFTER UPDATE ON medical_records BEGIN
+                    INSERT INTO medical_records_fts(medical_records_fts, rowid, ocr_text, clinical_summary)
+                    VALUES ('delete', old.rowid, old.ocr_text, old.clinical_summary);
+                    INSERT INTO medical_records_fts(rowid, ocr_text, clinical_summary)
+                    VALUES (new.rowid, new.ocr_text, new.clinical_summary);
+                END
+            """)
+
+            # Backfill on first creation: the triggers only cover rows
+            # written afterwards, so records that predate the index
+            # would otherwise never match
+            if not fts_existed:
+                cursor.execute(
+                    "INSERT INTO medical_records_fts(medical_records_fts) VALUES('rebuild')"
+                )
 
-    def _add_domain_info_column(self):
-        """Add domain_info column to medical_records table if it doesn't exist."""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("PRAGMA table_info(medical_records)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'domain_info' not in columns:
-                cursor.execute("ALTER TABLE medical_records ADD COLUMN domain_info TEXT")
-                self.conn.commit()
-                print("✓ Added 'domain_info' column to 'medical_records' table.")
+            self.conn.commit()
+            self._fts_enabled = True
         except Exception as e:
-            print(f"Error checking/adding domain_info column: {e}")
-
-    def _add_diseases_column(self):
-        """Add diseases column to medical_records table if it doesn't exist."""
+            # FTS5 may be compiled out of the sqlite build - fall back to LIKE
+            print(f"⚠ Full-text index unavailable: {e}")
+            self._fts_enabled = False
+
+    @staticmethod
+    def _fts_query(search_text: str) -> str:
+        """Build an FTS5 MATCH expression from raw user text (tokens ANDed)"""
+        tokens = [t.replace('"', '""') for t in search_text.split()]
+        return ' '.join(f'"{t}"' for t in tokens)
+
+    # Columns added to medical_records after the original schema
+    # shipped. The migration pass reads table_info once and issues only
+    # the missing ALTERs, instead of one PRAGMA round trip per column.
+    MEDICAL_RECORD_COLUMNS = (
+        ('patient_age', 'INTEGER'),
+        ('date', 'TEXT'),
+        ('domain_info', 'TEXT'),
+        ('diseases', 'TEXT'),
+        ('medications', 'TEXT'),
+        ('biomarkers', 'TEXT'),
+        ('symptoms', 'TEXT'),
+        ('procedures', 'TEXT'),
+        ('anomaly_detection', 'TEXT'),
+        ('ocr_confidence', 'REAL'),
+        ('llm_metadata', 'TEXT'),
+        ('historical_biomarkers', 'TEXT'),
+        ('content_hash', 'TEXT'),
+    )
+
+    def _migrate_medical_records(self):
+        """Add any medical_records columns missing from an older database."""
         try:
             cursor = self.conn.cursor()
             cursor.execute("PRAGMA table_info(medical_records)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'diseases' not in columns:
-                cursor.execute("ALTER TABLE medical_records ADD COLUMN diseases TEXT")
-                self.conn.commit()
-                print("✓ Added 'diseases' column to 'medical_records' table.")
-        except Exception as e:
-            print(f"Error checking/adding diseases column: {e}")
+            existing = {row[1] for row in cursor.fetchall()}
 
-    def _add_medications_column(self):
-        """Add medications column to medical_records table if it doesn't exist."""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("PRAGMA table_info(medical_records)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'medications' not in columns:
-                cursor.execute("ALTER TABLE medical_records ADD COLUMN medications TEXT")
-                self.conn.commit()
-                print("✓ Added 'medications' column to 'medical_records' table.")
-        except Exception as e:
-            print(f"Error checking/adding medications column: {e}")
+            for name, col_type in self.MEDICAL_RECORD_COLUMNS:
+                if name not in existing:
+                    cursor.execute(f"ALTER TABLE medical_records ADD COLUMN {name} {col_type}")
+                    print(f"✓ Added '{name}' column to 'medical_records' table.")
 
-    def _add_biomarkers_column(self):
-        """Add biomarkers column to medical_records table if it doesn't exist."""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("PRAGMA table_info(medical_records)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'biomarkers' not in columns:
-                cursor.execute("ALTER TABLE medical_records ADD COLUMN biomarkers TEXT")
-                self.conn.commit()
-                print("✓ Added 'biomarkers' column to 'medical_records' table.")
+            # Created here rather than with the other indexes because
+            # content_hash may only just have been added
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_medical_records_content_hash "
+                "ON medical_records(patient_id, content_hash)"
+            )
+            self.conn.commit()
         except Exception as e:
-            print(f"Error checking/adding biomarkers column: {e}")
+            print(f"Error migrating medical_records columns: {e}")
+
+
+
+
+
+
 
-    def _add_symptoms_column(self):
-        """Add symptoms column to medical_records table if it doesn't exist."""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("PRAGMA table_info(medical_records)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'symptoms' not in columns:
-                cursor.execute("ALTER TABLE medical_records ADD COLUMN symptoms TEXT")
-                self.conn.commit()
-                print("✓ Added 'symptoms' column to 'medical_records' table.")
-        except Exception as e:
-            print(f"Error checking/adding symptoms column: {e}")
 
-    def _add_procedures_column(self):
-        """Add procedures column to medical_records table if it doesn't exist."""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("PRAGMA table_info(medical_records)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'procedures' not in columns:
-                cursor.execute("ALTER TABLE medical_records ADD COLUMN procedures TEXT")
-                self.conn.commit()
-                print("✓ Added 'procedures' column to 'medical_records' table.")
-        except Exception as e:
-            print(f"Error checking/adding procedures column: {e}")
 
-    def _add_anomaly_detection_column(self):
-        """Add anomaly_detection column to medical_records table if it doesn't exist."""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("PRAGMA table_info(medical_records)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'anomaly_detection' not in columns:
-                cursor.execute("ALTER TABLE medical_records ADD COLUMN anomaly_detection TEXT")
-                self.conn.commit()
-                print("✓ Added 'anomaly_detection' column to 'medical_records' table.")
-        except Exception as e:
-            print(f"Error checking/adding anomaly_detection column: {e}")
 
-    def _add_ocr_confidence_column(self):
-        """Add ocr_confidence column to medical_records table if it doesn't exist."""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("PRAGMA table_info(medical_records)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'ocr_confidence' not in columns:
-                cursor.execute("ALTER TABLE medical_records ADD COLUMN ocr_confidence REAL")
-                self.conn.commit()
-                print("✓ Added 'ocr_confidence' column to 'medical_records' table.")
-        except Exception as e:
-            print(f"Error checking/adding ocr_confidence column: {e}")
 
-    def _add_llm_metadata_column(self):
-        """Add llm_metadata column to medical_records table if it doesn't exist."""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("PRAGMA table_info(medical_records)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'llm_metadata' not in columns:
-                cursor.execute("ALTER TABLE medical_records ADD COLUMN llm_metadata TEXT")
-                self.conn.commit()
-                print("✓ Added 'llm_metadata' column to 'medical_records' table.")
-        except Exception as e:
-            print(f"Error checking/adding llm_metadata column: {e}")
 
-    def _add_historical_biomarkers_column(self):
-        """Add historical_biomarkers column to medical_records table if it doesn't exist."""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("PRAGMA table_info(medical_records)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'historical_biomarkers' not in columns:
-                cursor.execute("ALTER TABLE medical_records ADD COLUMN historical_biomarkers TEXT")
-                self.conn.commit()
-                print("✓ Added 'historical_biomarkers' column to 'medical_records' table.")
-        except Exception as e:
-            print(f"Error checking/adding historical_biomarkers column: {e}")
 
     def _row_to_dict(self, row) -> Dict[str, Any]:
         """Convert SQLite Row to dictionary"""
@@ -354,6 +448,64 @@ class Database:
             return None
         return dict(row)
 
+    def _insert(self, table: str, row: Dict[str, Any]):
+        """Execute a single-row INSERT with a cached SQL string (no commit)"""
+        key = (table, tuple(row))
+        sql = self._insert_sql_cache.get(key)
+        if sql is None:
+            sql = (f"INSERT INTO {table} ({', '.join(row)}) "
+                   f"VALUES ({_ph(len(row))})")
+            self._insert_sql_cache[key] = sql
+        self.conn.execute(sql, tuple(row.values()))
+
+    def _update(self, table: str, row_id: str, updates: Dict[str, Any]):
+        """Execute an UPDATE ... WHERE id = ? with a cached SQL string (no commit)"""
+        key = (table, tuple(updates))
+        sql = self._update_sql_cache.get(key)
+        if sql is None:
+            sql = (f"UPDATE {table} SET {', '.join(f'{k} = ?' for k in updates)} "
+                   f"WHERE id = ?")
+            self._update_sql_cache[key] = sql
+        self.conn.execute(sql, (*updates.values(), row_id))
+
+    def _read_conn(self) -> sqlite3.Connection:
+        """
+        Per-thread read-only connection for SELECT traffic
+
+        Opened lazily with mode=ro the first time a thread reads, then
+        reused for that thread's lifetime. Readers never touch the write
+        lock, and under WAL they don't block the writer (or each other).
+        Falls back to the shared write connection if the read-only open
+        fails (e.g. an exotic filesystem without URI support).
+        """
+        conn = getattr(self._read_local, 'conn', None)
+        if conn is None:
+            try:
+                conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+                conn.row_factory = sqlite3.Row
+                conn.executescript("""
+                    PRAGMA cache_size=-8192;
+                    PRAGMA mmap_size=268435456;
+                    PRAGMA busy_timeout=5000;
+                """)
+            except sqlite3.Error as e:
+                print(f"Read-only connection unavailable, sharing write connection: {e}")
+                conn = self.conn
+            self._read_local.conn = conn
+        return conn
+
+    def ping(self) -> bool:
+        """
+        Cheapest possible liveness check for health probes
+
+        Runs SELECT 1 - no table access, no row counting.
+
+        Returns:
+            True if the connection answered
+        """
+        self.conn.execute("SELECT 1")
+        return True
+
     # ============================================================================
     # USER OPERATIONS
     # ============================================================================
@@ -369,8 +521,6 @@ class Database:
             Created user record
         """
         try:
-            cursor = self.conn.cursor()
-
             # Generate UUID if not provided
             if 'id' not in user_data:
                 user_data['id'] = str(uuid.uuid4())
@@ -379,13 +529,10 @@ class Database:
             user_data['created_at'] = datetime.now().isoformat()
             user_data['updated_at'] = datetime.now().isoformat()
 
-            # Build SQL query
-            columns = ', '.join(user_data.keys())
-            placeholders = ', '.join(['?' for _ in user_data.keys()])
-            query = f"INSERT INTO users ({columns}) VALUES ({placeholders})"
-
-            cursor.execute(query, list(user_data.values()))
-            self.conn.commit()
+            with self._write_lock:
+                self._insert('users', user_data)
+                self.conn.commit()
+            self._invalidate_user_cache()
 
             # Return the created user
             return self.get_user_by_id(user_data['id'])
@@ -393,11 +540,55 @@ class Database:
             print(f"Error creating user: {e}")
             raise
 
+    def _fetch_user_by_id(self, user_id: str, _epoch: int = 0) -> Optional[Dict[str, Any]]:
+        """Uncached user lookup (wrapped by the LRU in __init__)"""
+        row = self._read_conn().execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        return dict(row) if row else None
+
+    def _fetch_user_by_email(self, email: str, _epoch: int = 0) -> Optional[Dict[str, Any]]:
+        """Uncached email lookup (wrapped by the LRU in __init__)"""
+        row = self._read_conn().execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+        return dict(row) if row else None
+
     def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
         """Get user by email"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
+            user = self._user_by_email_cached(email, self._cache_epoch())
+            # Copy so callers can't mutate the cached row
+            return dict(user) if user else None
+        except Exception as e:
+            print(f"Error getting user: {e}")
+            return None
+
+    def get_user_by_email_row(self, email: str) -> Optional[sqlite3.Row]:
+        """
+        Get a user as a raw sqlite3.Row (no dict conversion)
+
+        Hot-path variant for the login credential check: a Row is a
+        thin wrapper over the result tuple, so the per-column dict
+        build is deferred until the caller actually needs one (i.e.
+        not at all for a failed login). Reads directly rather than
+        through the LRU cache, which stores dicts.
+
+        Args:
+            email: User's email
+
+        Returns:
+            sqlite3.Row or None
+        """
+        try:
+            return self._read_conn().execute(
+                "SELECT * FROM users WHERE email = ?", (email,)
+            ).fetchone()
+        except Exception as e:
+            print(f"Error getting user: {e}")
+            return None
+
+    def get_user_by_google_id(self, google_id: str) -> Optional[Dict[str, Any]]:
+        """Get user by Google OAuth ID"""
+        try:
+            cursor = self._read_conn().cursor()
+            cursor.execute("SELECT * FROM users WHERE google_id = ?", (google_id,))
             row = cursor.fetchone()
             return self._row_to_dict(row)
         except Exception as e:
@@ -407,10 +598,8 @@ class Database:
     def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
         """Get user by ID"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-            row = cursor.fetchone()
-            return self._row_to_dict(row)
+            user = self._user_by_id_cached(user_id, self._cache_epoch())
+            return dict(user) if user else None
         except Exception as e:
             print(f"Error getting user: {e}")
             return None
@@ -418,16 +607,12 @@ class Database:
     def update_user(self, user_id: str, updates: Dict[str, Any]) -> Dict[str, Any]:
         """Update user information"""
         try:
-            cursor = self.conn.cursor()
             updates['updated_at'] = datetime.now().isoformat()
 
-            # Build SQL query
-            set_clause = ', '.join([f"{key} = ?" for key in updates.keys()])
-            query = f"UPDATE users SET {set_clause} WHERE id = ?"
-            values = list(updates.values()) + [user_id]
-
-            cursor.execute(query, values)
-            self.conn.commit()
+            with self._write_lock:
+                self._update('users', user_id, updates)
+                self.conn.commit()
+            self._invalidate_user_cache()
 
             return self.get_user_by_id(user_id)
         except Exception as e:
@@ -437,12 +622,13 @@ class Database:
     def update_last_login(self, user_id: str):
         """Update user's last login timestamp"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(
-                "UPDATE users SET last_login = ? WHERE id = ?",
-                (datetime.now().isoformat(), user_id)
-            )
-            self.conn.commit()
+            with self._write_lock:
+                self.conn.execute(
+                    "UPDATE users SET last_login = ? WHERE id = ?",
+                    (datetime.now().isoformat(), user_id)
+                )
+                self.conn.commit()
+            self._invalidate_user_cache()
         except Exception as e:
             print(f"Error updating last login: {e}")
 
@@ -453,8 +639,6 @@ class Database:
     def create_medical_record(self, record_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create a new medical record"""
         try:
-            cursor = self.conn.cursor()
-
             # Generate UUID if not provided
             if 'id' not in record_data:
                 record_data['id'] = str(uuid.uuid4())
@@ -464,16 +648,15 @@ class Database:
             record_data['updated_at'] = datetime.now().isoformat()
             # Convert complex types to JSON strings
             for key, value in record_data.items():
-                if isinstance(value, (dict, list)):
-                    record_data[key] = json.dumps(value, cls=NpEncoder)
-
-            # Build SQL query
-            columns = ', '.join(record_data.keys())
-            placeholders = ', '.join(['?' for _ in record_data.keys()])
-            query = f"INSERT INTO medical_records ({columns}) VALUES ({placeholders})"
+                if isinstance(value, (dict, list, np.ndarray)):
+                    record_data[key] = orjson.dumps(
+                        value, option=orjson.OPT_SERIALIZE_NUMPY
+                    ).decode()
 
-            cursor.execute(query, list(record_data.values()))
-            self.conn.commit()
+            with self._write_lock:
+                self._insert('medical_records', record_data)
+                self.conn.commit()
+            self._record_by_id_cached.cache_clear()
 
             # Return the created record
             return self.get_record_by_id(record_data['id'])
@@ -481,53 +664,206 @@ class Database:
             print(f"Error creating medical record: {e}")
             raise
 
-    def get_patient_records(self, patient_id: str, limit: int = 20, offset: int = 0, order_by: str = 'created_at') -> List[Dict[str, Any]]:
-        """Get medical records for a patient with pagination"""
+    # Sort columns accepted by get_patient_records - order_by is
+    # interpolated into SQL, so anything outside this set is rejected
+    RECORD_ORDER_COLUMNS = {'created_at', 'document_date', 'file_size', 'overall_severity'}
+
+    # One final query string per allowed sort column, rendered at class
+    # definition: the f-string interpolation only ever sees whitelisted
+    # names, and repeat calls reuse the identical string
+    _PAGE_QUERIES = {
+        col: (
+            f"SELECT *, COUNT(*) OVER() AS _total FROM medical_records "
+            f"WHERE patient_id = ? ORDER BY {col} DESC LIMIT ? OFFSET ?"
+        )
+        for col in RECORD_ORDER_COLUMNS
+    }
+
+    def get_patient_records(self, patient_id: str, limit: int = 20, offset: int = 0,
+                            order_by: str = 'created_at') -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Get medical records for a patient with pagination
+
+        The total count piggybacks on the page query via COUNT(*) OVER()
+        so callers get an exact total without a second round trip.
+
+        Args:
+            patient_id: Patient's user ID
+            limit: Page size
+            offset: Rows to skip
+            order_by: Sort column (validated against RECORD_ORDER_COLUMNS)
+
+        Returns:
+            (records, total) tuple
+        """
+        if order_by not in self.RECORD_ORDER_COLUMNS:
+            order_by = 'created_at'
+
         try:
-            cursor = self.conn.cursor()
-            query = f"SELECT * FROM medical_records WHERE patient_id = ? ORDER BY {order_by} DESC LIMIT ? OFFSET ?"
-            cursor.execute(query, (patient_id, limit, offset))
-            rows = cursor.fetchall()
-            return [self._row_to_dict(row) for row in rows]
+            cursor = self._read_conn().cursor()
+            cursor.execute(self._PAGE_QUERIES[order_by], (patient_id, limit, offset))
+            rows = [dict(row) for row in cursor]
+            if rows:
+                total = rows[0].pop('_total')
+                for row in rows[1:]:
+                    row.pop('_total', None)
+            else:
+                # COUNT(*) OVER() rides on the returned rows, so an
+                # offset past the last row yields none - fall back to a
+                # plain count rather than reporting total=0
+                cursor.execute(
+                    "SELECT COUNT(*) FROM medical_records WHERE patient_id = ?",
+                    (patient_id,)
+                )
+                total = cursor.fetchone()[0]
+            return rows, total
         except Exception as e:
             print(f"Error getting patient records: {e}")
+            return [], 0
+
+    def get_patient_records_page(self, patient_id: str, limit: int = 20,
+                                 after: Optional[tuple] = None) -> List[Dict[str, Any]]:
+        """
+        Get a page of medical records using keyset pagination
+
+        Unlike OFFSET, the cost here stays O(page size) no matter how
+        deep the caller pages - the (created_at, id) predicate seeks
+        straight to the start of the page.
+
+        Args:
+            patient_id: Patient's user ID
+            limit: Page size
+            after: (created_at, id) of the last row of the previous page
+
+        Returns:
+            List of records, newest first
+        """
+        try:
+            cursor = self._read_conn().cursor()
+            if after:
+                cursor.execute(
+                    "SELECT * FROM medical_records WHERE patient_id = ? "
+                    "AND (created_at, id) < (?, ?) "
+                    "ORDER BY created_at DESC, id DESC LIMIT ?",
+                    (patient_id, after[0], after[1], limit)
+                )
+            else:
+                cursor.execute(
+                    "SELECT * FROM medical_records WHERE patient_id = ? "
+                    "ORDER BY created_at DESC, id DESC LIMIT ?",
+                    (patient_id, limit)
+                )
+            return [dict(row) for row in cursor]
+        except Exception as e:
+            print(f"Error getting patient records page: {e}")
             return []
 
+    # medical_records columns stored as serialized JSON. Reads decode
+    # exactly these instead of prefix-sniffing every string column,
+    # which also stops false-positive parses of plain text that merely
+    # starts with '{' or '['.
+    JSON_COLUMNS = frozenset({
+        'domain_info', 'diseases', 'medications', 'biomarkers', 'symptoms',
+        'procedures', 'anomaly_detection', 'llm_metadata',
+        'historical_biomarkers', 'clinical_summary',
+    })
+
+    def _fetch_record_by_id(self, record_id: str, _epoch: int = 0) -> Optional[Dict[str, Any]]:
+        """Uncached record lookup with JSON columns parsed (LRU-wrapped)"""
+        row = self._read_conn().execute(
+            "SELECT * FROM medical_records WHERE id = ?", (record_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        record = dict(row)
+        # Parse the JSON columns back to complex types - a record can
+        # carry eight or more of these blobs, and orjson decodes them
+        # several times faster than the stdlib parser
+        for key in self.JSON_COLUMNS:
+            value = record.get(key)
+            if isinstance(value, str) and value:
+                try:
+                    record[key] = orjson.loads(value)
+                except orjson.JSONDecodeError:
+                    pass  # Legacy plain-text value
+        return record
+
     def get_record_by_id(self, record_id: str) -> Optional[Dict[str, Any]]:
         """Get a medical record by ID"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT * FROM medical_records WHERE id = ?", (record_id,))
-            row = cursor.fetchone()
-            record = self._row_to_dict(row)
+            record = self._record_by_id_cached(record_id, self._cache_epoch())
+            return dict(record) if record else None
+        except Exception as e:
+            print(f"Error getting record: {e}")
+            return None
+
+    def get_record_by_content_hash(self, patient_id: str, content_hash: str) -> Optional[Dict[str, Any]]:
+        """
+        Find a patient's record with matching file content
+
+        Used for upload dedup: a re-uploaded document is detected by its
+        SHA-256 before any processing happens.
 
-            if record:
-                # Parse JSON strings back to complex types
-                for key, value in record.items():
-                    if isinstance(value, str) and value.startswith(('{', '[')):
-                        try:
-                            record[key] = json.loads(value)
-                        except json.JSONDecodeError:
-                            pass # Not a valid JSON string
+        Args:
+            patient_id: Patient's user ID
+            content_hash: SHA-256 hex digest of the file contents
 
-            return record
+        Returns:
+            Existing record or None
+        """
+        try:
+            cursor = self._read_conn().cursor()
+            cursor.execute(
+                "SELECT * FROM medical_records WHERE patient_id = ? AND content_hash = ? LIMIT 1",
+                (patient_id, content_hash)
+            )
+            return self._row_to_dict(cursor.fetchone())
         except Exception as e:
-            print(f"Error getting record: {e}")
+            print(f"Error looking up record by content hash: {e}")
+            return None
+
+    def get_record_with_children(self, record_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a record plus its biomarkers, medications and anomalies
+
+        One database call replaces the four sequential fetches the API
+        layer used to issue; the child queries reuse a single cursor.
+
+        Args:
+            record_id: Record ID
+
+        Returns:
+            Dictionary with record, biomarkers, medications, anomalies,
+            or None if the record doesn't exist
+        """
+        record = self.get_record_by_id(record_id)
+        if not record:
             return None
 
+        try:
+            cursor = self._read_conn().cursor()
+            children = {}
+            for key, table in (('biomarkers', 'biomarkers'),
+                               ('medications', 'medications'),
+                               ('anomalies', 'anomalies')):
+                cursor.execute(f"SELECT * FROM {table} WHERE record_id = ?", (record_id,))
+                children[key] = [dict(row) for row in cursor]
+        except Exception as e:
+            print(f"Error getting record children: {e}")
+            children = {'biomarkers': [], 'medications': [], 'anomalies': []}
+
+        return {'record': record, **children}
+
     def update_medical_record(self, record_id: str, updates: Dict[str, Any]) -> Dict[str, Any]:
         """Update a medical record"""
         try:
-            cursor = self.conn.cursor()
             updates['updated_at'] = datetime.now().isoformat()
 
-            # Build SQL query
-            set_clause = ', '.join([f"{key} = ?" for key in updates.keys()])
-            query = f"UPDATE medical_records SET {set_clause} WHERE id = ?"
-            values = list(updates.values()) + [record_id]
-
-            cursor.execute(query, values)
-            self.conn.commit()
+            with self._write_lock:
+                self._update('medical_records', record_id, updates)
+                self.conn.commit()
+            self._record_by_id_cached.cache_clear()
 
             return self.get_record_by_id(record_id)
         except Exception as e:
@@ -537,13 +873,12 @@ class Database:
     def get_critical_records(self, patient_id: str) -> List[Dict[str, Any]]:
         """Get records with critical alerts for a patient"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._read_conn().cursor()
             cursor.execute(
                 "SELECT * FROM medical_records WHERE patient_id = ? AND has_critical_alerts = 1 ORDER BY created_at DESC",
                 (patient_id,)
             )
-            rows = cursor.fetchall()
-            return [self._row_to_dict(row) for row in rows]
+            return [dict(row) for row in cursor]
         except Exception as e:
             print(f"Error getting critical records: {e}")
             return []
@@ -551,66 +886,266 @@ class Database:
     def create_biomarker(self, biomarker_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create a new biomarker entry"""
         try:
-            cursor = self.conn.cursor()
-
             if 'id' not in biomarker_data:
                 biomarker_data['id'] = str(uuid.uuid4())
             biomarker_data['created_at'] = datetime.now().isoformat()
 
-            columns = ', '.join(biomarker_data.keys())
-            placeholders = ', '.join(['?' for _ in biomarker_data.keys()])
-            query = f"INSERT INTO biomarkers ({columns}) VALUES ({placeholders})"
-
-            cursor.execute(query, list(biomarker_data.values()))
-            self.conn.commit()
+            with self._write_lock:
+                self._insert('biomarkers', biomarker_data)
+                self.conn.commit()
 
-            cursor.execute("SELECT * FROM biomarkers WHERE id = ?", (biomarker_data['id'],))
+            cursor = self.conn.execute(
+                "SELECT * FROM biomarkers WHERE id = ?", (biomarker_data['id'],)
+            )
             return self._row_to_dict(cursor.fetchone())
         except Exception as e:
             print(f"Error creating biomarker: {e}")
             raise
 
+    def _create_bulk(self, table: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Insert many rows with one executemany in one transaction
+
+        The per-row create_* helpers cost one prepared statement, one
+        commit (a WAL sync), and one read-back SELECT each; for an OCR
+        document emitting dozens of biomarkers that was the hottest
+        write path. Here ids and timestamps are assigned up front, all
+        rows go through a single statement and commit, and the enriched
+        input dicts are returned directly instead of being re-read.
+
+        Args:
+            table: Target table name
+            rows: Row dictionaries to insert
+
+        Returns:
+            The inserted rows with id/created_at filled in
+        """
+        if not rows:
+            return []
+        try:
+            now = datetime.now().isoformat()
+            prepared = []
+            for row in rows:
+                row = dict(row)
+                row.setdefault('id', str(uuid.uuid4()))
+                row['created_at'] = now
+                prepared.append(row)
+
+            # Normalize to one column order across rows; missing keys
+            # bind as NULL
+            columns = list(dict.fromkeys(key for row in prepared for key in row))
+            sql = (f"INSERT INTO {table} ({', '.join(columns)}) "
+                   f"VALUES ({_ph(len(columns))})")
+
+            with self._write_lock:
+                self.conn.executemany(
+                    sql, [[row.get(col) for col in columns] for row in prepared]
+                )
+                self.conn.commit()
+            return prepared
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error bulk inserting into {table}: {e}")
+            return []
+
     def create_biomarkers_bulk(self, biomarkers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Create multiple biomarkers at once"""
-        created = []
-        for biomarker in biomarkers:
-            try:
-                created.append(self.create_biomarker(biomarker))
-            except Exception as e:
-                print(f"Error creating biomarker: {e}")
-        return created
+        return self._create_bulk('biomarkers', biomarkers)
+
+    def persist_ingestion_result(self, record_id: str, record_update: Dict[str, Any],
+                                 biomarkers: List[Dict[str, Any]],
+                                 medications: List[Dict[str, Any]],
+                                 anomalies: List[Dict[str, Any]],
+                                 diseases: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        Persist a document's extraction output in one transaction
+
+        The record update and all child inserts commit together, so a
+        partially-processed upload never leaves orphaned biomarkers or
+        anomalies behind, and the per-row commit cost is paid once.
+
+        Args:
+            record_id: Medical record ID
+            record_update: Fields to update on the record
+            biomarkers: Biomarker rows to insert
+            medications: Medication rows to insert
+            anomalies: Anomaly rows to insert
+            diseases: Accepted for parity with the extraction output;
+                this store has no diseases table, so they are dropped
+
+        Returns:
+            The updated medical record
+        """
+        try:
+            with self._write_lock:
+                return self._persist_ingestion_locked(
+                    record_id, record_update, biomarkers, medications, anomalies
+                )
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error persisting ingestion result: {e}")
+            raise
+
+    def _persist_ingestion_locked(self, record_id, record_update,
+                                  biomarkers, medications, anomalies):
+        """Run the multi-table ingestion transaction (write lock held)"""
+        cursor = self.conn.cursor()
+        now = datetime.now().isoformat()
+
+        record_update = dict(record_update, updated_at=now)
+        self._update('medical_records', record_id, record_update)
+
+        for table, rows in (('biomarkers', biomarkers),
+                            ('medications', medications),
+                            ('anomalies', anomalies)):
+            if not rows:
+                continue
+            prepared = []
+            for row in rows:
+                row = dict(row)
+                row.setdefault('id', str(uuid.uuid4()))
+                row['created_at'] = now
+                prepared.append(row)
+            columns = list(prepared[0].keys())
+            placeholders = _ph(len(columns))
+            cursor.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                [[row[col] for col in columns] for row in prepared]
+            )
+
+        self.conn.commit()
+        self._record_by_id_cached.cache_clear()
+
+        cursor.execute("SELECT * FROM medical_records WHERE id = ?", (record_id,))
+        return self._row_to_dict(cursor.fetchone())
+
+    def ingest_document(self, record: Dict[str, Any],
+                        biomarkers: Optional[List[Dict[str, Any]]] = None,
+                        medications: Optional[List[Dict[str, Any]]] = None,
+                        anomalies: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        Create a record and all of its children in one transaction
+
+        Insert-side counterpart of persist_ingestion_result (which
+        updates an existing record): callers that build the whole
+        document in memory first pay one commit for the record plus
+        every child row, and a failure rolls the lot back so no
+        half-ingested document is left behind.
+
+        Args:
+            record: Medical record fields
+            biomarkers: Biomarker rows to insert
+            medications: Medication rows to insert
+            anomalies: Anomaly rows to insert
+
+        Returns:
+            The created medical record
+        """
+        try:
+            now = datetime.now().isoformat()
+            record = dict(record)
+            record.setdefault('id', str(uuid.uuid4()))
+            record['created_at'] = now
+            record['updated_at'] = now
+            for key, value in record.items():
+                if isinstance(value, (dict, list, np.ndarray)):
+                    record[key] = orjson.dumps(
+                        value, option=orjson.OPT_SERIALIZE_NUMPY
+                    ).decode()
+
+            with self._write_lock:
+                try:
+                    self._insert('medical_records', record)
+                    for table, rows in (('biomarkers', biomarkers),
+                                        ('medications', medications),
+                                        ('anomalies', anomalies)):
+                        if not rows:
+                            continue
+                        prepared = []
+                        for row in rows:
+                            row = dict(row)
+                            row.setdefault('id', str(uuid.uuid4()))
+                            row.setdefault('record_id', record['id'])
+                            row['created_at'] = now
+                            prepared.append(row)
+                        columns = list(prepared[0].keys())
+                        placeholders = _ph(len(columns))
+                        self.conn.executemany(
+                            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                            [[row[col] for col in columns] for row in prepared]
+                        )
+                    self.conn.commit()
+                except Exception:
+                    self.conn.rollback()
+                    raise
+            self._record_by_id_cached.cache_clear()
+
+            return self.get_record_by_id(record['id'])
+        except Exception as e:
+            print(f"Error ingesting document: {e}")
+            raise
+
+    # Same idea as _ANOM_QUERIES: both shapes of the biomarker listing
+    # rendered once, keyed by whether a type filter is present
+    _BIOMARKER_QUERIES = {
+        False: "SELECT * FROM biomarkers WHERE patient_id = ? ORDER BY measurement_date DESC LIMIT ?",
+        True: "SELECT * FROM biomarkers WHERE patient_id = ? AND biomarker_type = ? ORDER BY measurement_date DESC LIMIT ?",
+    }
 
     def get_patient_biomarkers(self, patient_id: str, biomarker_type: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
         """Get biomarkers for a patient, optionally filtered by type"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._read_conn().cursor()
             if biomarker_type:
-                cursor.execute(
-                    "SELECT * FROM biomarkers WHERE patient_id = ? AND biomarker_type = ? ORDER BY measurement_date DESC LIMIT ?",
-                    (patient_id, biomarker_type, limit)
-                )
+                params = (patient_id, biomarker_type, limit)
             else:
-                cursor.execute(
-                    "SELECT * FROM biomarkers WHERE patient_id = ? ORDER BY measurement_date DESC LIMIT ?",
-                    (patient_id, limit)
-                )
-            rows = cursor.fetchall()
-            return [self._row_to_dict(row) for row in rows]
+                params = (patient_id, limit)
+            cursor.execute(self._BIOMARKER_QUERIES[bool(biomarker_type)], params)
+            return [dict(row) for row in cursor]
         except Exception as e:
             print(f"Error getting biomarkers: {e}")
             return []
 
+    def iter_patient_biomarkers(self, patient_id: str,
+                                biomarker_type: Optional[str] = None):
+        """
+        Stream a patient's biomarkers one row at a time
+
+        Generator variant of get_patient_biomarkers for consumers that
+        process rows incrementally (exports, large trend scans) - only
+        one row dict is alive at a time instead of the whole result set.
+
+        Args:
+            patient_id: Patient's user ID
+            biomarker_type: Optional type filter
+
+        Yields:
+            Biomarker dictionaries, newest first
+        """
+        cursor = self._read_conn().cursor()
+        if biomarker_type:
+            cursor.execute(
+                "SELECT * FROM biomarkers WHERE patient_id = ? AND biomarker_type = ? ORDER BY measurement_date DESC",
+                (patient_id, biomarker_type)
+            )
+        else:
+            cursor.execute(
+                "SELECT * FROM biomarkers WHERE patient_id = ? ORDER BY measurement_date DESC",
+                (patient_id,)
+            )
+        for row in cursor:
+            yield dict(row)
+
     def get_biomarker_trend(self, patient_id: str, biomarker_type: str, days: int = 90) -> List[Dict[str, Any]]:
         """Get biomarker values over time for trend analysis"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._read_conn().cursor()
             cutoff_date = (datetime.now() - timedelta(days=days)).date().isoformat()
             cursor.execute(
                 "SELECT * FROM biomarkers WHERE patient_id = ? AND biomarker_type = ? AND measurement_date >= ? ORDER BY measurement_date ASC",
                 (patient_id, biomarker_type, cutoff_date)
             )
-            rows = cursor.fetchall()
-            return [self._row_to_dict(row) for row in rows]
+            return [dict(row) for row in cursor]
         except Exception as e:
             print(f"Error getting biomarker trend: {e}")
             return []
@@ -618,21 +1153,18 @@ class Database:
     def create_anomaly(self, anomaly_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create a new anomaly entry"""
         try:
-            cursor = self.conn.cursor()
-
             if 'id' not in anomaly_data:
                 anomaly_data['id'] = str(uuid.uuid4())
             anomaly_data['created_at'] = datetime.now().isoformat()
             anomaly_data['detection_date'] = datetime.now().isoformat()
 
-            columns = ', '.join(anomaly_data.keys())
-            placeholders = ', '.join(['?' for _ in anomaly_data.keys()])
-            query = f"INSERT INTO anomalies ({columns}) VALUES ({placeholders})"
-
-            cursor.execute(query, list(anomaly_data.values()))
-            self.conn.commit()
+            with self._write_lock:
+                self._insert('anomalies', anomaly_data)
+                self.conn.commit()
 
-            cursor.execute("SELECT * FROM anomalies WHERE id = ?", (anomaly_data['id'],))
+            cursor = self.conn.execute(
+                "SELECT * FROM anomalies WHERE id = ?", (anomaly_data['id'],)
+            )
             return self._row_to_dict(cursor.fetchone())
         except Exception as e:
             print(f"Error creating anomaly: {e}")
@@ -640,20 +1172,61 @@ class Database:
 
     def create_anomalies_bulk(self, anomalies: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Create multiple anomalies at once"""
-        created = []
+        now = datetime.now().isoformat()
+        anomalies = [dict(anomaly) for anomaly in anomalies]
         for anomaly in anomalies:
-            try:
-                created.append(self.create_anomaly(anomaly))
-            except Exception as e:
-                print(f"Error creating anomaly: {e}")
-        return created
+            anomaly.setdefault('detection_date', now)
+        return self._create_bulk('anomalies', anomalies)
+
+    # The four filter combinations rendered once at class definition -
+    # every call hands SQLite a string it has already prepared instead
+    # of concatenating a fresh one, keyed by (critical_only,
+    # unacknowledged_only)
+    _ANOM_QUERIES = {
+        (critical, unack):
+            "SELECT * FROM anomalies WHERE patient_id = ?"
+            + (" AND is_critical = 1" if critical else "")
+            + (" AND acknowledged = 0" if unack else "")
+            + " ORDER BY detection_date DESC"
+        for critical in (False, True) for unack in (False, True)
+    }
 
     def get_patient_anomalies(self, patient_id: str, critical_only: bool = False, unacknowledged_only: bool = False) -> List[Dict[str, Any]]:
         """Get anomalies for a patient"""
         try:
-            cursor = self.conn.cursor()
-            query = "SELECT * FROM anomalies WHERE patient_id = ?"
-            params = [patient_id]
+            cursor = self._read_conn().cursor()
+            cursor.execute(
+                self._ANOM_QUERIES[(bool(critical_only), bool(unacknowledged_only))],
+                (patient_id,)
+            )
+            return [dict(row) for row in cursor]
+        except Exception as e:
+            print(f"Error getting anomalies: {e}")
+            return []
+
+    def get_anomalies_for_patients(self, patient_ids: List[str], critical_only: bool = False,
+                                   unacknowledged_only: bool = False) -> List[Dict[str, Any]]:
+        """
+        Get anomalies for many patients in one query
+
+        Replaces per-patient lookups (the dashboard's N+1 pattern) with
+        a single IN query; callers group the rows by patient_id.
+
+        Args:
+            patient_ids: Patient user IDs
+            critical_only: Only critical anomalies
+            unacknowledged_only: Only unacknowledged anomalies
+
+        Returns:
+            List of anomalies across all requested patients
+        """
+        if not patient_ids:
+            return []
+
+        try:
+            cursor = self._read_conn().cursor()
+            placeholders = _ph(len(patient_ids))
+            query = f"SELECT * FROM anomalies WHERE patient_id IN ({placeholders})"
 
             if critical_only:
                 query += " AND is_critical = 1"
@@ -662,45 +1235,121 @@ class Database:
 
             query += " ORDER BY detection_date DESC"
 
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-            return [self._row_to_dict(row) for row in rows]
+            cursor.execute(query, list(patient_ids))
+            return [dict(row) for row in cursor]
         except Exception as e:
-            print(f"Error getting anomalies: {e}")
+            print(f"Error getting anomalies for patients: {e}")
             return []
 
+    def get_critical_alert_summary(self, patient_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Per-patient critical alert counts plus the most severe anomaly
+
+        The aggregation runs in SQL - GROUP BY with MAX(severity), where
+        SQLite picks the remaining columns from the max row - so the
+        caller never scans anomaly lists in Python.
+
+        Args:
+            patient_ids: Patient user IDs
+
+        Returns:
+            Mapping of patient_id to {'alert_count', 'most_severe'}
+        """
+        if not patient_ids:
+            return {}
+
+        try:
+            cursor = self._read_conn().cursor()
+            placeholders = _ph(len(patient_ids))
+            cursor.execute(
+                f"""SELECT *, COUNT(*) AS _alert_count, MAX(severity) AS _max_severity
+                    FROM anomalies
+                    WHERE patient_id IN ({placeholders})
+                      AND is_critical = 1 AND acknowledged = 0
+                    GROUP BY patient_id""",
+                list(patient_ids)
+            )
+            summary = {}
+            for row in cursor.fetchall():
+                anomaly = dict(row)
+                alert_count = anomaly.pop('_alert_count')
+                anomaly.pop('_max_severity', None)
+                summary[anomaly['patient_id']] = {
+                    'alert_count': alert_count,
+                    'most_severe': anomaly
+                }
+            return summary
+        except Exception as e:
+            print(f"Error getting critical alert summary: {e}")
+            return {}
+
     def acknowledge_anomaly(self, anomaly_id: str, doctor_id: str) -> Dict[str, Any]:
         """Mark an anomaly as acknowledged"""
         try:
             cursor = self.conn.cursor()
-            cursor.execute(
-                "UPDATE anomalies SET acknowledged = 1, acknowledged_by = ?, acknowledged_at = ? WHERE id = ?",
-                (doctor_id, datetime.now().isoformat(), anomaly_id)
-            )
-            self.conn.commit()
+            with self._write_lock:
+                cursor.execute(
+                    "UPDATE anomalies SET acknowledged = 1, acknowledged_by = ?, acknowledged_at = ? WHERE id = ?",
+                    (doctor_id, datetime.now().isoformat(), anomaly_id)
+                )
+                self.conn.commit()
             cursor.execute("SELECT * FROM anomalies WHERE id = ?", (anomaly_id,))
             return self._row_to_dict(cursor.fetchone())
         except Exception as e:
             print(f"Error acknowledging anomaly: {e}")
             raise
 
-    def create_medication(self, medication_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Create a new medication entry"""
+    def acknowledge_anomaly_for_doctor(self, anomaly_id: str, doctor_id: str):
+        """
+        Acknowledge an anomaly with the access check folded in
+
+        Replaces the route's fetch-whole-row / check-access / update
+        sequence: only patient_id is read for the authorization guard,
+        and everything runs on one connection in one call.
+
+        Args:
+            anomaly_id: Anomaly ID
+            doctor_id: Acknowledging doctor's user ID
+
+        Returns:
+            ('ok', updated_row), ('not_found', None) or ('forbidden', None)
+        """
         try:
             cursor = self.conn.cursor()
+            cursor.execute("SELECT patient_id FROM anomalies WHERE id = ?", (anomaly_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return 'not_found', None
+
+            if not self.check_doctor_access(doctor_id, row['patient_id']):
+                return 'forbidden', None
+
+            with self._write_lock:
+                cursor.execute(
+                    "UPDATE anomalies SET acknowledged = 1, acknowledged_by = ?, acknowledged_at = ? WHERE id = ?",
+                    (doctor_id, datetime.now().isoformat(), anomaly_id)
+                )
+                self.conn.commit()
+            cursor.execute("SELECT * FROM anomalies WHERE id = ?", (anomaly_id,))
+            return 'ok', self._row_to_dict(cursor.fetchone())
+        except Exception as e:
+            print(f"Error acknowledging anomaly: {e}")
+            raise
 
+    def create_medication(self, medication_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Create a new medication entry"""
+        try:
             if 'id' not in medication_data:
                 medication_data['id'] = str(uuid.uuid4())
             medication_data['created_at'] = datetime.now().isoformat()
 
-            columns = ', '.join(medication_data.keys())
-            placeholders = ', '.join(['?' for _ in medication_data.keys()])
-            query = f"INSERT INTO medications ({columns}) VALUES ({placeholders})"
-
-            cursor.execute(query, list(medication_data.values()))
-            self.conn.commit()
+            with self._write_lock:
+                self._insert('medications', medication_data)
+                self.conn.commit()
 
-            cursor.execute("SELECT * FROM medications WHERE id = ?", (medication_data['id'],))
+            cursor = self.conn.execute(
+                "SELECT * FROM medications WHERE id = ?", (medication_data['id'],)
+            )
             return self._row_to_dict(cursor.fetchone())
         except Exception as e:
             print(f"Error creating medication: {e}")
@@ -708,24 +1357,17 @@ class Database:
 
     def create_medications_bulk(self, medications: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Create multiple medications at once"""
-        created = []
-        for medication in medications:
-            try:
-                created.append(self.create_medication(medication))
-            except Exception as e:
-                print(f"Error creating medication: {e}")
-        return created
+        return self._create_bulk('medications', medications)
 
     def get_patient_medications(self, patient_id: str) -> List[Dict[str, Any]]:
         """Get all medications for a patient"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._read_conn().cursor()
             cursor.execute(
                 "SELECT * FROM medications WHERE patient_id = ? ORDER BY prescribed_date DESC",
                 (patient_id,)
             )
-            rows = cursor.fetchall()
-            return [self._row_to_dict(row) for row in rows]
+            return [dict(row) for row in cursor]
         except Exception as e:
             print(f"Error getting medications: {e}")
             return []
@@ -733,13 +1375,12 @@ class Database:
     def get_record_biomarkers(self, record_id: str) -> List[Dict[str, Any]]:
         """Get all biomarkers for a specific record"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._read_conn().cursor()
             cursor.execute(
                 "SELECT * FROM biomarkers WHERE record_id = ? ORDER BY measurement_date DESC",
                 (record_id,)
             )
-            rows = cursor.fetchall()
-            return [self._row_to_dict(row) for row in rows]
+            return [dict(row) for row in cursor]
         except Exception as e:
             print(f"Error getting biomarkers for record: {e}")
             return []
@@ -747,13 +1388,12 @@ class Database:
     def get_record_medications(self, record_id: str) -> List[Dict[str, Any]]:
         """Get all medications for a specific record"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._read_conn().cursor()
             cursor.execute(
                 "SELECT * FROM medications WHERE record_id = ? ORDER BY prescribed_date DESC",
                 (record_id,)
             )
-            rows = cursor.fetchall()
-            return [self._row_to_dict(row) for row in rows]
+            return [dict(row) for row in cursor]
         except Exception as e:
             print(f"Error getting medications for record: {e}")
             return []
@@ -761,13 +1401,12 @@ class Database:
     def get_record_anomalies(self, record_id: str) -> List[Dict[str, Any]]:
         """Get all anomalies for a specific record"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._read_conn().cursor()
             cursor.execute(
                 "SELECT * FROM anomalies WHERE record_id = ? ORDER BY severity DESC, detected_at DESC",
                 (record_id,)
             )
-            rows = cursor.fetchall()
-            return [self._row_to_dict(row) for row in rows]
+            return [dict(row) for row in cursor]
         except Exception as e:
             print(f"Error getting anomalies for record: {e}")
             return []
@@ -786,16 +1425,116 @@ class Database:
         return []
 
     def grant_doctor_access(self, access_data: Dict[str, Any]) -> Dict[str, Any]:
-        return None
+        """Grant a doctor access to a patient's records"""
+        try:
+            if 'id' not in access_data:
+                access_data['id'] = str(uuid.uuid4())
+            access_data['created_at'] = datetime.now().isoformat()
+
+            with self._write_lock:
+                self._insert('doctor_access', access_data)
+                self.conn.commit()
+
+            cursor = self.conn.execute(
+                "SELECT * FROM doctor_access WHERE id = ?", (access_data['id'],)
+            )
+            return self._row_to_dict(cursor.fetchone())
+        except Exception as e:
+            print(f"Error granting doctor access: {e}")
+            raise
 
     def check_doctor_access(self, doctor_id: str, patient_id: str) -> bool:
-        return False
+        """Check whether a doctor has active access to a patient"""
+        try:
+            cursor = self._read_conn().cursor()
+            cursor.execute(
+                "SELECT 1 FROM doctor_access WHERE doctor_id = ? AND patient_id = ? "
+                "AND is_active = 1 LIMIT 1",
+                (doctor_id, patient_id)
+            )
+            return cursor.fetchone() is not None
+        except Exception as e:
+            print(f"Error checking doctor access: {e}")
+            return False
 
-    def get_doctor_patients(self, doctor_id: str) -> List[Dict[str, Any]]:
-        return []
+    def get_doctor_patients(self, doctor_id: str,
+                            limit: Optional[int] = 50, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Get the patients a doctor has active access to
+
+        The users join happens in the same query, so callers get
+        patient_id plus profile fields from one SELECT instead of an
+        access-row fetch followed by a lookup per patient. Pass
+        limit=None for the full roster (dashboard aggregation).
+        """
+        if limit is None:
+            limit = -1  # SQLite: LIMIT -1 means no limit
+        try:
+            cursor = self._read_conn().cursor()
+            cursor.execute(
+                """SELECT da.patient_id, da.access_level, da.created_at AS granted_at,
+                          u.full_name, u.email, u.age, u.gender, u.phone
+                   FROM doctor_access da
+                   JOIN users u ON u.id = da.patient_id
+                   WHERE da.doctor_id = ? AND da.is_active = 1
+                   ORDER BY u.full_name
+                   LIMIT ? OFFSET ?""",
+                (doctor_id, limit, offset)
+            )
+            return [dict(row) for row in cursor]
+        except Exception as e:
+            print(f"Error getting doctor patients: {e}")
+            return []
+
+    def search_accessible_patients(self, doctor_id: str, query: str,
+                                   limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Search patients by name or email with the filter pushed into SQL
+
+        The substring match and the access scoping both run in the
+        database - one join against doctor_access instead of loading
+        the doctor's whole roster into Python.
+
+        Args:
+            doctor_id: Doctor's user ID
+            query: Substring to match against full_name or email
+            limit: Maximum results
+
+        Returns:
+            List of accessible matching patient dicts
+        """
+        try:
+            cursor = self._read_conn().cursor()
+            pattern = f"%{query.lower()}%"
+            cursor.execute(
+                """SELECT u.* FROM doctor_access da
+                   JOIN users u ON u.id = da.patient_id
+                   WHERE da.doctor_id = ? AND da.is_active = 1
+                     AND (LOWER(u.full_name) LIKE ? OR LOWER(u.email) LIKE ?)
+                   LIMIT ?""",
+                (doctor_id, pattern, pattern, limit)
+            )
+            return [dict(row) for row in cursor]
+        except Exception as e:
+            print(f"Error searching patients: {e}")
+            return []
 
     def revoke_doctor_access(self, access_id: str, revoked_by: str) -> Dict[str, Any]:
-        return None
+        """Revoke a doctor's access to a patient"""
+        try:
+            cursor = self.conn.cursor()
+            with self._write_lock:
+                cursor.execute(
+                    "UPDATE doctor_access SET is_active = 0, revoked_at = ?, revoked_by = ? "
+                    "WHERE id = ?",
+                    (datetime.now().isoformat(), revoked_by, access_id)
+                )
+                self.conn.commit()
+            cursor.execute("SELECT * FROM doctor_access WHERE id = ?", (access_id,))
+            return self._row_to_dict(cursor.fetchone())
+        except Exception as e:
+            print(f"Error revoking doctor access: {e}")
+            raise
 
     def create_doctor_note(self, note_data: Dict[str, Any]) -> Dict[str, Any]:
         return None
@@ -814,7 +1553,7 @@ class Database:
                       end_date: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
         """Search medical records with various filters"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._read_conn().cursor()
             query = "SELECT * FROM medical_records WHERE 1=1"
             params = []
 
@@ -835,23 +1574,54 @@ class Database:
                 params.append(end_date)
 
             if search_text:
-                query += " AND ocr_text LIKE ?"
-                params.append(f"%{search_text}%")
+                if getattr(self, '_fts_enabled', False):
+                    # Inverted-index lookup instead of a LIKE scan over ocr_text
+                    query += (" AND rowid IN (SELECT rowid FROM medical_records_fts"
+                              " WHERE medical_records_fts MATCH ?)")
+                    params.append(self._fts_query(search_text))
+                else:
+                    query += " AND ocr_text LIKE ?"
+                    params.append(f"%{search_text}%")
 
             query += " ORDER BY created_at DESC LIMIT ?"
             params.append(limit)
 
             cursor.execute(query, params)
-            rows = cursor.fetchall()
-            return [self._row_to_dict(row) for row in rows]
+            return [dict(row) for row in cursor]
         except Exception as e:
             print(f"Error searching records: {e}")
             return []
 
+    def get_patient_overview(self, patient_id: str, recent_limit: int = 10) -> Dict[str, Any]:
+        """
+        Fetch everything the doctor patient-detail view needs in one call
+
+        Bundles the patient row, recent records, unacknowledged critical
+        anomalies, and summary counts so the API layer makes a single
+        database call instead of four sequential ones.
+
+        Args:
+            patient_id: Patient's user ID
+            recent_limit: How many recent records to include
+
+        Returns:
+            Dictionary with patient, recent_records, critical_anomalies, summary
+        """
+        return {
+            'patient': self.get_user_by_id(patient_id),
+            'recent_records': self.get_patient_records(
+                patient_id, limit=recent_limit, order_by='created_at'
+            )[0],
+            'critical_anomalies': self.get_patient_anomalies(
+                patient_id, critical_only=True, unacknowledged_only=True
+            ),
+            'summary': self.get_patient_summary(patient_id)
+        }
+
     def get_patient_summary(self, patient_id: str) -> Dict[str, Any]:
         """Get summary statistics for a patient"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._read_conn().cursor()
 
             # Get total records
             cursor.execute("SELECT COUNT(*) as count FROM medical_records WHERE patient_id = ?", (patient_id,))
@@ -885,6 +1655,55 @@ class Database:
                 'last_upload': None
             }
 
+    def get_dashboard(self, patient_id: str, anomaly_limit: int = 50,
+                      biomarker_limit: int = 50) -> Dict[str, Any]:
+        """
+        Fetch summary stats, recent anomalies, and recent biomarkers together
+
+        The patient dashboard calls summary, anomalies, and biomarkers on
+        every page load; serving all three from one method collapses the
+        four summary counts into a single SELECT of scalar subqueries and
+        saves the API layer two round-trips.
+
+        Args:
+            patient_id: Patient's user ID
+            anomaly_limit: How many recent anomalies to include
+            biomarker_limit: How many recent biomarkers to include
+
+        Returns:
+            Dictionary with summary, anomalies, biomarkers
+        """
+        try:
+            cursor = self._read_conn().cursor()
+            cursor.execute(
+                """
+                SELECT
+                    (SELECT COUNT(*) FROM medical_records WHERE patient_id = :pid) AS total_records,
+                    (SELECT COUNT(*) FROM medical_records WHERE patient_id = :pid AND has_critical_alerts = 1) AS critical_records,
+                    (SELECT COUNT(*) FROM anomalies WHERE patient_id = :pid AND acknowledged = 0) AS unacknowledged_anomalies,
+                    (SELECT MAX(created_at) FROM medical_records WHERE patient_id = :pid) AS last_upload
+                """,
+                {'pid': patient_id}
+            )
+            summary = dict(cursor.fetchone())
+
+            cursor.execute(
+                "SELECT * FROM anomalies WHERE patient_id = ? ORDER BY detection_date DESC LIMIT ?",
+                (patient_id, anomaly_limit)
+            )
+            anomalies = [dict(row) for row in cursor]
+
+            cursor.execute(
+                "SELECT * FROM biomarkers WHERE patient_id = ? ORDER BY measurement_date DESC LIMIT ?",
+                (patient_id, biomarker_limit)
+            )
+            biomarkers = [dict(row) for row in cursor]
+
+            return {'summary': summary, 'anomalies': anomalies, 'biomarkers': biomarkers}
+        except Exception as e:
+            print(f"Error getting dashboard: {e}")
+            return {'summary': {}, 'anomalies': [], 'biomarkers': []}
+
 
 # Singleton instance
 _db_instance = None
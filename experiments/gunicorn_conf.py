@@ -0,0 +1,22 @@
+"""
+Gunicorn configuration for the MediVault API
+
+Every endpoint here is IO-bound (database calls, Redis, LLM requests),
+so gevent workers let a single process hold hundreds of in-flight
+requests that are waiting on the network instead of one. Gunicorn's
+gevent worker monkey-patches the stdlib sockets before the app is
+imported, so blocking HTTP clients cooperate automatically.
+
+Usage:
+    gunicorn -c gunicorn_conf.py app_new:app
+"""
+
+import multiprocessing
+
+bind = '0.0.0.0:5000'
+worker_class = 'gevent'
+workers = multiprocessing.cpu_count() * 2 + 1
+worker_connections = 1000
+
+# LLM-backed endpoints (e.g. /api/records/ask) can run for many seconds
+timeout = 120
@@ -3,12 +3,35 @@ Authentication Service for MediVault
 Handles user authentication, JWT tokens, and password management
 """
 
+import hashlib
+import sys
+import time
+
 import jwt
 import bcrypt
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from config import Config
 from database import get_database
+from services.cache import get_cache_service
+
+# Cap on cached-user TTL so profile updates propagate quickly
+USER_CACHE_MAX_TTL = 300  # seconds
+
+
+def _run_native(func, *args):
+    """
+    Run a CPU-bound bcrypt call without stalling a gevent event loop
+
+    bcrypt burns 100-300 ms of CPU per call; under the gevent
+    deployment that would freeze every other request on the worker, so
+    the call is shipped to the hub's native threadpool. Outside gevent
+    the request already owns a real thread and the call runs inline.
+    """
+    if 'gevent' in sys.modules:
+        from gevent import get_hub
+        return get_hub().threadpool.apply(func, args)
+    return func(*args)
 
 
 class AuthService:
@@ -18,6 +41,7 @@ class AuthService:
 
     def __init__(self):
         self.db = get_database()
+        self.cache = get_cache_service()
         self.jwt_secret = Config.JWT_SECRET_KEY
         self.jwt_algorithm = Config.JWT_ALGORITHM
         self.jwt_expiry_hours = Config.JWT_EXPIRY_HOURS
@@ -26,19 +50,27 @@ class AuthService:
     # PASSWORD MANAGEMENT
     # ============================================================================
 
-    def hash_password(self, password: str) -> str:
-        """Hash a password using bcrypt"""
+    @staticmethod
+    def _hash_password(password: str) -> str:
         salt = bcrypt.gensalt()
         hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
         return hashed.decode('utf-8')
 
-    def verify_password(self, password: str, password_hash: str) -> bool:
-        """Verify a password against its hash"""
+    @staticmethod
+    def _check_password(password: str, password_hash: str) -> bool:
         return bcrypt.checkpw(
             password.encode('utf-8'),
             password_hash.encode('utf-8')
         )
 
+    def hash_password(self, password: str) -> str:
+        """Hash a password using bcrypt (off-loop under gevent)"""
+        return _run_native(self._hash_password, password)
+
+    def verify_password(self, password: str, password_hash: str) -> bool:
+        """Verify a password against its hash (off-loop under gevent)"""
+        return _run_native(self._check_password, password, password_hash)
+
     # ============================================================================
     # JWT TOKEN MANAGEMENT
     # ============================================================================
@@ -283,22 +315,25 @@ class AuthService:
         Raises:
             ValueError: If credentials are invalid
         """
-        # Get user
-        user = self.db.get_user_by_email(email)
-        if not user:
+        # Get user as a raw Row - the credential checks only touch
+        # three columns, so the dict conversion waits until they pass
+        row = self.db.get_user_by_email_row(email)
+        if row is None:
             raise ValueError("Invalid email or password")
 
         # Check if user is active
-        if not user.get('is_active', True):
+        if not row['is_active']:
             raise ValueError("Account has been deactivated")
 
         # Verify password
-        if not user.get('password_hash'):
+        if not row['password_hash']:
             raise ValueError("Please login with Google OAuth")
 
-        if not self.verify_password(password, user['password_hash']):
+        if not self.verify_password(password, row['password_hash']):
             raise ValueError("Invalid email or password")
 
+        user = dict(row)
+
         # Update last login
         self.db.update_last_login(user['id'])
 
@@ -309,31 +344,9 @@ class AuthService:
             user_type=user['user_type']
         )
 
-        # Return user data and token
-        user_response = {
-            'id': user['id'],
-            'email': user['email'],
-            'full_name': user['full_name'],
-            'user_type': user['user_type'],
-            'profile_picture_url': user.get('profile_picture_url')
-        }
-
-        # Add type-specific fields
-        if user['user_type'] == 'patient':
-            user_response.update({
-                'age': user.get('age'),
-                'gender': user.get('gender'),
-                'date_of_birth': user.get('date_of_birth')
-            })
-        elif user['user_type'] == 'doctor':
-            user_response.update({
-                'license_number': user.get('license_number'),
-                'specialization': user.get('specialization'),
-                'hospital_affiliation': user.get('hospital_affiliation')
-            })
-
+        # Return user data and token (same shape the session endpoint serves)
         return {
-            'user': user_response,
+            'user': self.build_session_view(user),
             'token': token
         }
 
@@ -362,14 +375,8 @@ class AuthService:
         Returns:
             Dictionary with user data and token
         """
-        # Check if user exists by Google ID
-        user = None
-        try:
-            response = self.db.client.table('users').select('*').eq('google_id', google_id).execute()
-            if response.data:
-                user = response.data[0]
-        except Exception:
-            pass
+        # Check if user exists by Google ID (persistent connection, indexed column)
+        user = self.db.get_user_by_google_id(google_id)
 
         # If not found by Google ID, check by email
         if not user:
@@ -419,21 +426,89 @@ class AuthService:
     # AUTHORIZATION
     # ============================================================================
 
+    def build_session_view(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Shape the public session payload for a user
+
+        Built once when the user is fetched (and cached alongside it),
+        so /api/auth/session serves a ready-made dict instead of
+        reassembling the fields on every poll.
+
+        Args:
+            user: Full user row
+
+        Returns:
+            Dictionary with only the client-facing session fields
+        """
+        view = {
+            'id': user['id'],
+            'email': user['email'],
+            'full_name': user['full_name'],
+            'user_type': user['user_type'],
+            'profile_picture_url': user.get('profile_picture_url')
+        }
+
+        if user['user_type'] == 'patient':
+            view.update({
+                'age': user.get('age'),
+                'gender': user.get('gender'),
+                'date_of_birth': user.get('date_of_birth')
+            })
+        elif user['user_type'] == 'doctor':
+            view.update({
+                'license_number': user.get('license_number'),
+                'specialization': user.get('specialization'),
+                'hospital_affiliation': user.get('hospital_affiliation')
+            })
+
+        return view
+
+    def user_version(self, user_id: str) -> int:
+        """Monotonic per-user version counter (drives profile/session ETags)"""
+        return self.cache.get(f"user_version:{user_id}") or 0
+
+    def bump_user_version(self, user_id: str):
+        """Advance the user's version so stale client caches revalidate"""
+        self.cache.incr(f"user_version:{user_id}")
+
+    def _token_cache_key(self, token: str) -> str:
+        """Cache key for a token's resolved user (hash, never the raw token)"""
+        return f"auth:{hashlib.blake2b(token.encode(), digest_size=16).hexdigest()}"
+
+    def invalidate_token_cache(self, token: str):
+        """Drop the cached user for a token (called on logout)"""
+        self.cache.delete(self._token_cache_key(token))
+
     def get_current_user(self, token: str) -> Optional[Dict[str, Any]]:
         """
         Get current user from token
 
+        Every authenticated request goes through here, so the resolved
+        user is cached keyed by token hash - cache hits skip both the
+        JWT decode and the database lookup. TTL is bounded by the
+        token's remaining lifetime.
+
         Args:
             token: JWT token
 
         Returns:
             User data or None if invalid
         """
+        cache_key = self._token_cache_key(token)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         payload = self.verify_token(token)
         if not payload:
             return None
 
         user = self.db.get_user_by_id(payload['user_id'])
+        if user:
+            user['_session_view'] = self.build_session_view(user)
+            ttl = int(payload['exp'] - time.time())
+            if ttl > 0:
+                self.cache.set(cache_key, user, expire_seconds=min(ttl, USER_CACHE_MAX_TTL))
         return user
 
     def require_patient(self, token: str) -> Dict[str, Any]:
@@ -3,7 +3,7 @@ Caching Service for MediVault
 Redis-based caching for performance optimization
 """
 
-import json
+import orjson
 import redis
 from typing import Optional, Any
 from datetime import timedelta
@@ -53,7 +53,7 @@ class CacheService:
         try:
             value = self.client.get(self._make_key(key))
             if value:
-                return json.loads(value)
+                return orjson.loads(value)
             return None
         except Exception as e:
             print(f"Cache get error: {e}")
@@ -80,7 +80,10 @@ class CacheService:
             return False
 
         try:
-            serialized = json.dumps(value)
+            # orjson decodes cached sessions/user dicts several times
+            # faster than the stdlib json module - this runs on every
+            # authenticated request via the token cache
+            serialized = orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
             if expire_seconds:
                 self.client.setex(
                     self._make_key(key),
@@ -94,6 +97,117 @@ class CacheService:
             print(f"Cache set error: {e}")
             return False
 
+    def get_raw(self, key: str) -> Optional[str]:
+        """
+        Get a value without JSON decoding
+
+        Used for pre-serialized response bodies that go straight into a
+        Response object, skipping the decode/re-encode round trip.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Cached payload or None
+        """
+        if not self.enabled or not self.client:
+            return None
+
+        try:
+            return self.client.get(self._make_key(key))
+        except Exception as e:
+            print(f"Cache get error: {e}")
+            return None
+
+    def set_raw(self, key: str, value, expire_seconds: Optional[int] = 300) -> bool:
+        """
+        Store an already-serialized payload as-is
+
+        Args:
+            key: Cache key
+            value: Serialized payload (bytes or str)
+            expire_seconds: Expiration time in seconds (default: 5 minutes)
+
+        Returns:
+            True if successful, False otherwise
+        """
+        if not self.enabled or not self.client:
+            return False
+
+        try:
+            if expire_seconds:
+                self.client.setex(self._make_key(key), expire_seconds, value)
+            else:
+                self.client.set(self._make_key(key), value)
+            return True
+        except Exception as e:
+            print(f"Cache set error: {e}")
+            return False
+
+    def incr(self, key: str) -> Optional[int]:
+        """
+        Atomically increment an integer counter
+
+        Args:
+            key: Cache key
+
+        Returns:
+            New counter value, or None if caching is disabled
+        """
+        if not self.enabled or not self.client:
+            return None
+
+        try:
+            return self.client.incr(self._make_key(key))
+        except Exception as e:
+            print(f"Cache incr error: {e}")
+            return None
+
+    def set_is_member(self, key: str, member: str) -> bool:
+        """
+        Check Redis set membership (O(1))
+
+        Args:
+            key: Set key
+            member: Member to test
+
+        Returns:
+            True if the member is in the set, False otherwise or if
+            caching is disabled
+        """
+        if not self.enabled or not self.client:
+            return False
+
+        try:
+            return bool(self.client.sismember(self._make_key(key), member))
+        except Exception as e:
+            print(f"Cache sismember error: {e}")
+            return False
+
+    def set_add(self, key: str, member: str, expire_seconds: int = 300) -> bool:
+        """
+        Add a member to a Redis set with a TTL
+
+        Args:
+            key: Set key
+            member: Member to add
+            expire_seconds: TTL applied to the whole set
+
+        Returns:
+            True if successful, False otherwise
+        """
+        if not self.enabled or not self.client:
+            return False
+
+        try:
+            full_key = self._make_key(key)
+            self.client.sadd(full_key, member)
+            self.client.expire(full_key, expire_seconds)
+            return True
+        except Exception as e:
+            print(f"Cache sadd error: {e}")
+            return False
+
     def delete(self, key: str) -> bool:
         """
         Delete value from cache
@@ -128,10 +242,19 @@ class CacheService:
             return 0
 
         try:
-            keys = self.client.keys(self._make_key(pattern))
-            if keys:
-                return self.client.delete(*keys)
-            return 0
+            # SCAN walks the keyspace in cursor-sized steps (KEYS blocks
+            # the whole server) and UNLINK frees memory off-thread, so
+            # upload responses don't wait on the purge
+            deleted = 0
+            batch = []
+            for key in self.client.scan_iter(match=self._make_key(pattern), count=500):
+                batch.append(key)
+                if len(batch) >= 500:
+                    deleted += self.client.unlink(*batch)
+                    batch = []
+            if batch:
+                deleted += self.client.unlink(*batch)
+            return deleted
         except Exception as e:
             print(f"Cache clear pattern error: {e}")
             return 0
@@ -179,25 +302,29 @@ class CacheService:
         """Invalidate all cache for a patient"""
         self.clear_pattern(f"patient:{patient_id}:*")
 
+    # Trend responses are cached as serialized JSON bytes rather than
+    # Python objects: with a 30-minute TTL each entry is served hundreds
+    # of times, and storing the finished body means a hit costs one
+    # Redis GET instead of decode + jsonify re-encode
     def cache_biomarker_trend(
         self,
         patient_id: str,
         biomarker_type: str,
-        data: list,
+        body,
         expire_minutes: int = 30
     ):
-        """Cache biomarker trend data"""
+        """Cache a pre-serialized biomarker trend response body"""
         key = f"biomarker:trend:{patient_id}:{biomarker_type}"
-        self.set(key, data, expire_seconds=expire_minutes * 60)
+        self.set_raw(key, body, expire_seconds=expire_minutes * 60)
 
     def get_biomarker_trend(
         self,
         patient_id: str,
         biomarker_type: str
-    ) -> Optional[list]:
-        """Get cached biomarker trend"""
+    ) -> Optional[str]:
+        """Get a cached biomarker trend response body"""
         key = f"biomarker:trend:{patient_id}:{biomarker_type}"
-        return self.get(key)
+        return self.get_raw(key)
 
 
 # Singleton instance